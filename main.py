@@ -1,18 +1,24 @@
 import sys
 from typing import Literal, Union
 
-from PySide6.QtCore import QEvent, QObject, Qt
+from PySide6.QtCore import QEvent, QObject, Qt, QTimer, Signal
 from PySide6.QtGui import (QAction, QBrush, QColor, QKeyEvent, QKeySequence,
                            QSurfaceFormat)
 from PySide6.QtOpenGLWidgets import QOpenGLWidget
-from PySide6.QtWidgets import (QApplication, QComboBox, QHBoxLayout,
-                               QHeaderView, QLabel, QMainWindow, QSizePolicy,
-                               QSpinBox, QTableWidget, QTableWidgetItem,
-                               QWidget)
+from PySide6.QtWidgets import (QApplication, QComboBox, QFileDialog, QHBoxLayout,
+                               QLabel, QMainWindow, QSizePolicy,
+                               QSpinBox, QTableView, QWidget)
 
-from src.data_utils import DocumentData
+from src.corpus_registry import CORPUS_REGISTRY
 from src.doc_landscape import VisGraphicsScene, VisGraphicsView
 from src.doc_table import TableView
+from src.fit_tasks import fit_embedding_task, fit_topics_task
+from src.fit_worker import FitScheduler
+from src.tracing import TRACER, format_breakdown, span, traced
+
+# range of the number of topics spinbox (there are 12 topic colours)
+MIN_TOPICS = 1
+MAX_TOPICS = 12
 
 
 class GlobalEventFilter(QObject):
@@ -37,9 +43,23 @@ class CentralWidget(QWidget):
     """
     Class for holding the central widget of our application.
     """
+    # message for the status bar
+    statusMessage = Signal(str)
+    # timing breakdown of the last traced operation (see src/tracing.py)
+    traceMessage = Signal(str)
 
     def __init__(self, global_event_filter) -> None:
         QWidget.__init__(self)
+        self.document = None
+        self.document_coords = None
+
+        # background fitting of the embeddings and topics
+        self.fit_scheduler = FitScheduler(parent=self)
+        self.fit_scheduler.finished.connect(self.on_fit_finished)
+        self.fit_scheduler.failed.connect(self.on_fit_failed)
+        self.fit_scheduler.progress.connect(self.statusMessage)
+        TRACER.subscribe(self.on_trace)
+
         # init subwidget - scene
         self.scene = VisGraphicsScene(global_event_filter)
         self.scene.selectionChanged.connect(self.generateTable)  # connect selection change to table update
@@ -62,8 +82,9 @@ class CentralWidget(QWidget):
         # init subwidget - table
         self.table_view = TableView()
         self.table = self.table_view.table
-        self.table.setSelectionMode(QTableWidget.NoSelection)
-        self.table.itemClicked.connect(self.on_table_item_clicked)
+        self.table.setSelectionMode(QTableView.NoSelection)
+        self.table.clicked.connect(self.on_table_item_clicked)
+        self.scene.selectionChanged.connect(self.table_view.on_selection_changed)  # live wordcloud
 
         # set layout for table right and visualization left
         self.main_layout = QHBoxLayout()
@@ -83,96 +104,152 @@ class CentralWidget(QWidget):
         # set the layout to the widget
         self.setLayout(self.main_layout)
 
+    @traced("load data")
     def reload_data(self, name: str = "kos",
                     dimred_solver: Union[Literal["pca"], Literal["umap"], Literal["tsne"]] = "tsne",
                     topic_solver: Union[Literal["nmf"], Literal["lda"]] = "nmf", n_components: int = 10,
                     num_topic_words: int = 5):
-        # load all data
-        self.document = DocumentData(data_path="data/bag+of+words", name=name)
+        # load all data, the recently used datasets are kept loaded (with the documents added to them)
+        self.document = CORPUS_REGISTRY.get("data/bag+of+words", name)
+        # a registered dataset still has the topics it was shown with, the scene waits for the requested ones
+        self.document.clear_topics()
         self.document.brush = self.brush
         self.table_view.document_data = self.document
-        self.document_coords = self.document.fit_transform(dimred_solver)
-        self.document.fit_topics(solver=topic_solver, n_components=n_components)
+        self.document_coords = None
+        self.scene.clear()
+        self.scene.set_selection(self.document.selection)  # one selection shared by the scene, table and data
+        self.table_view.model.set_documents(None, self.brush)
+        self.request_embedding(dimred_solver)
+        self.request_topics(topic_solver, n_components=n_components)
         # self.topics = self.document.get_topics_words(self.topics_all)
         # self.document.topic_words = self.topics
         # self.document.doc_topic = self.doc_topic
         # self.document.topics_all = self.topics_all
-        # add data
-        self.reload_scene()
 
     def reload_topics(self, topic_solver: Union[Literal["nmf"], Literal["lda"]] = 'nmf', n_components: int = 10,
                          num_topic_words: int = 5):
-        self.document.fit_topics(topic_solver, n_components=n_components)
+        self.request_topics(topic_solver, n_components=n_components)
         # self.topics = self.document.get_topics_words(self.topics_all)
         # self.document.topic_words = self.topics
         # self.document.doc_topic = self.doc_topic
         # self.document.topics_all = self.topics_all
-        self.reload_scene()
 
+    def request_embedding(self, dimred_solver: Union[Literal["pca"], Literal["umap"], Literal["tsne"]]):
+        # cached results are used right away, only the misses go to the worker processes
+        self.pending_dimred_solver = dimred_solver
+        coords = self.document.cached_transform(dimred_solver)
+        if coords is not None:
+            self.fit_scheduler.cancel("dimred")
+            self.on_fit_finished("dimred", coords)
+        else:
+            self.fit_scheduler.submit("dimred", f"{dimred_solver} embedding of {self.document.name}",
+                                      fit_embedding_task, self.document.data_path, self.document.name, dimred_solver)
+
+    def request_topics(self, topic_solver: Union[Literal["nmf"], Literal["lda"]], n_components: int = 10):
+        self.pending_topic_solver = topic_solver
+        self.pending_n_components = n_components
+        topics = self.document.cached_topics(topic_solver, n_components=n_components)
+        if topics is not None:
+            self.fit_scheduler.cancel("topics")
+            self.on_fit_finished("topics", topics)
+        else:
+            self.fit_scheduler.submit("topics", f"{topic_solver} with {n_components} topics of {self.document.name}",
+                                      fit_topics_task, self.document.data_path, self.document.name, topic_solver,
+                                      n_components, key=("topics", self.document.name, topic_solver, n_components))
+
+    def speculate_topics(self):
+        """
+        Precompute the neighbouring numbers of topics and the other topic solver in idle workers
+        """
+        self.fit_scheduler.clear_speculation()
+        solver, n_components = self.pending_topic_solver, self.pending_n_components
+        other_solver = "lda" if solver == "nmf" else "nmf"
+        candidates = [(solver, n_components + step) for step in (1, -1, 2, -2)] + [(other_solver, n_components)]
+        for candidate_solver, candidate_n in candidates:
+            if not MIN_TOPICS <= candidate_n <= MAX_TOPICS:
+                continue
+            if self.document.cached_topics(candidate_solver, n_components=candidate_n) is not None:
+                continue
+            self.fit_scheduler.speculate(("topics", self.document.name, candidate_solver, candidate_n),
+                                         f"{candidate_solver} with {candidate_n} topics of {self.document.name}",
+                                         fit_topics_task, self.document.data_path, self.document.name,
+                                         candidate_solver, candidate_n)
+
+    def on_fit_finished(self, slot: str, result):
+        with span(f"apply {slot}"):
+            if slot == "dimred":
+                # the workers fit the corpus as compiled, the documents added since are projected here
+                self.document_coords = self.document.extend_embedding(self.pending_dimred_solver, result)
+            else:
+                self.document.set_topics(self.pending_topic_solver, *result)
+            # the scene is drawn once both the embedding and the topics are available
+            if self.document_coords is not None and self.document.doc_topics is not None \
+                    and not self.fit_scheduler.is_running("dimred") and not self.fit_scheduler.is_running("topics"):
+                self.reload_scene()
+                self.statusMessage.emit(f"Data {self.document.name} loaded and plotted")
+                self.speculate_topics()
+
+    def on_fit_failed(self, slot: str, message: str):
+        self.statusMessage.emit(message)
+        # the request is dropped, the pending state goes back to what is shown
+        if slot == "dimred":
+            self.pending_dimred_solver = None
+        elif self.document.topics is not None:
+            self.pending_topic_solver = self.document.topics_method
+            self.pending_n_components = self.document.topics.shape[0]
+
+    @traced("plot")
     def reload_scene(self):
         self.scene.clear()
         self.scene.wasDragg = False
         self.scene.generateAndMapData(self.document_coords, self.document.doc_topics, self.brush)
 
+    @traced("add documents")
+    def add_documents(self, docword_path: str):
+        """
+        Add the documents of a docword file (over the vocabulary of the loaded dataset) without refitting,
+        only the new documents are drawn into the plot
+        """
+        if self.document is None:
+            return
+        try:
+            counts = self.document.load_documents(docword_path)
+        except (OSError, ValueError) as e:
+            self.statusMessage.emit(f"Documents could not be added: {e}")
+            return
+        new_ids = self.document.add_documents(counts)
+        if self.document_coords is not None:
+            self.document_coords = self.document.extend_embedding(self.pending_dimred_solver, self.document_coords)
+        if self.scene.cloud is not None:
+            self.scene.add_documents(self.document_coords[new_ids], self.document.doc_topics[new_ids])
+            self.generateTable()
+        self.statusMessage.emit(f"{new_ids.shape[0]} documents added to {self.document.name}")
+
     def reload_num_topic_words(self, num_topic_words: int = 5):
         pass
         # self.topics = self.document.get_topics_words(self.topics_all, n=num_topic_words)
         # self.document.topic_words = self.topics
 
+    @traced("table")
     def generateTable(self):
-        self.table.clear()
-        self.table.setRowCount(self.document.doc_topics.shape[0])
-        self.table.setColumnCount(3)
-        self.table.setHorizontalHeaderLabels(["Doc ID", "Topic ID", "Topic Colour"])
-        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
-        self.table.verticalHeader().setVisible(False)
-
-        # obtain selected documents from the scene + sort them
-        selected_docs = sorted(self.scene.selected_docs, reverse=False)
-        self.document.selected_documents = selected_docs
-
-        # global idx
-        idx = 0
-        # first add the selected documents
-        for doc_id in selected_docs:
-            # self.table.insertRow(0) #insert at the beginning
-            item_id = QTableWidgetItem(str(doc_id))
-            item_topic_id = QTableWidgetItem(str(self.document.doc_topics[doc_id]))
-            item_topic_colour = QTableWidgetItem()
-            item_topic_colour.setBackground(self.brush[self.document.doc_topics[doc_id]])
-            self.table.setItem(idx, 0, item_id)
-            self.table.setItem(idx, 1, item_topic_id)
-            self.table.setItem(idx, 2, item_topic_colour)
-            idx += 1
-
-        # then add the rest of the documents
-        for i, topic in enumerate(self.document.doc_topics):
-            if i in selected_docs:
-                continue
-            item_id = QTableWidgetItem(str(i))
-            item_topic_id = QTableWidgetItem(str(topic))
-            item_topic_colour = QTableWidgetItem()
-            item_topic_colour.setBackground(self.brush[topic])
-            self.table.setItem(idx, 0, item_id)
-            self.table.setItem(idx, 1, item_topic_id)
-            self.table.setItem(idx, 2, item_topic_colour)
-            idx += 1
-
-        # highlight the selected rows
-        for col in range(0, 2):
-            for row in range(len(selected_docs)):
-                self.table.item(row, col).setSelected(True)
+        if self.document is None or self.document.doc_topics is None:
+            return
+        model = self.table_view.model
+        if model.doc_topics is not self.document.doc_topics:  # new data or topics
+            model.set_documents(self.document.doc_topics, self.brush)
+        # the selected documents go first, only the row order changes
+        model.set_selection(self.document.selection)
 
         # self.table.sortByColumn(1, Qt.SortOrder.AscendingOrder)
 
-        self.table.resizeColumnsToContents()
+    def on_trace(self, operation):
+        # called from the thread which ran the operation, the signal delivers it to the GUI thread
+        self.traceMessage.emit(format_breakdown(operation))
 
-    def on_table_item_clicked(self, item):
-        # Get the row and column of the clicked item
-        row = item.row()
-        first_column_item = self.table.item(row, 0)
-        doc_idx = int(first_column_item.text())
-        self.scene.handle_item_click(self.scene.doc_elipses[doc_idx])
+    def on_table_item_clicked(self, index):
+        # Get the document of the clicked row
+        doc_idx = self.table_view.model.doc_id(index.row())
+        self.scene.handle_doc_click(doc_idx)
 
 
 class LabeledWidget(QWidget):
@@ -208,6 +285,12 @@ class MainWindow(QMainWindow):
         self.status_bar = self.statusBar()
         self.status_bar.showMessage("Ready, to load a file go to File -> Open -> Kos/Nips/Enron/Nytimes/Pubmed",
                                     timeout=500000)
+        self.central_widget.statusMessage.connect(self.status_bar.showMessage)
+        # timings of the last operation, shown while tracing
+        self.trace_label = QLabel()
+        self.trace_label.setVisible(TRACER.enabled)
+        self.status_bar.addPermanentWidget(self.trace_label)
+        self.central_widget.traceMessage.connect(self.trace_label.setText)
 
         # menu
         self.init_menu()
@@ -221,40 +304,76 @@ class MainWindow(QMainWindow):
 
         self.show()
 
+    @traced("open dataset")
     def open_file_action(self, name: str):
         self.loaded_file = name
         self.status_bar.showMessage(f"Loading data {name}")
+        self.setWindowTitle(f'Document Corpus Visualization - dataset: {name}')
         # self.central_widget.reload_data(name, dimred_solver=self.dimred_literals[self.dimred_combo.currentIndex()],
         #                                 topic_solver=self.topic_literals[self.topic_combo.currentIndex()],
         #                                 n_components=self.num_topics_spinbox.value(), num_topic_words=self.num_topic_words_spinbox.value())
+        # the embedding and topics may be computed in background, the status bar is updated when they are plotted
         self.central_widget.reload_data(name, dimred_solver=self.dimred_literals[self.dimred_combo.currentIndex()],
                                         topic_solver=self.topic_literals[self.topic_combo.currentIndex()],
                                         n_components=self.num_topics_spinbox.value(), num_topic_words=0)
         self.central_widget.generateTable()
-        self.status_bar.showMessage(f"Data {name} loaded and plotted")
-        self.setWindowTitle(f'Document Corpus Visualization - dataset: {name}')
+
+    def add_documents_action(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Add Documents", "data/bag+of+words",
+                                              "UCI docword files (docword.*.txt);;All files (*)")
+        if path:
+            self.status_bar.showMessage(f"Adding documents from {path}")
+            self.central_widget.add_documents(path)
+
+    def tracing_action(self, enabled: bool):
+        TRACER.enabled = enabled
+        self.trace_label.setVisible(enabled)
+        self.trace_label.clear()
+        self.status_bar.showMessage("Tracing enabled, the timings of the last operation are shown on the right"
+                                    if enabled else "Tracing disabled")
+
+    def export_trace_action(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export Trace", "trace.json", "Chrome trace (*.json)")
+        if not path:
+            return
+        try:
+            n_spans = TRACER.export_chrome_trace(path)
+        except OSError as e:
+            self.status_bar.showMessage(f"Trace could not be exported: {e}")
+            return
+        self.status_bar.showMessage(f"{n_spans} spans exported to {path} (open in chrome://tracing or Perfetto)")
 
     def dimred_combo_action(self, index: int):
         dimred = self.dimred_literals[index]
+        self.status_bar.showMessage(f"Loading data {self.loaded_file} with {dimred}")
         self.central_widget.reload_data(self.loaded_file, dimred,
                                         topic_solver=self.topic_literals[self.topic_combo.currentIndex()],
                                         n_components=self.num_topics_spinbox.value())
-        self.status_bar.showMessage(f"Data {self.loaded_file} loaded and plotted with {dimred}")
 
     def topic_combo_action(self, index: int):
         topic_solver = self.topic_literals[index]
+        self.status_bar.showMessage(f"Computing topics with {topic_solver}")
         self.central_widget.reload_topics(topic_solver=topic_solver, n_components=self.num_topics_spinbox.value())
                                           #num_topic_words=self.num_topic_words_spinbox.value())
         self.central_widget.generateTable()
-        self.status_bar.showMessage(f"Topics computed with {topic_solver}")
 
-    def topic_num_topics_action(self, value: int):
+    def num_topics_spinbox_changed(self, value: int):
+        # coalesce quick spinbox changes, only the last value is computed
+        self.num_topics_timer.start()
+
+    def topic_num_topics_action(self):
+        value = self.num_topics_spinbox.value()
         # self.central_widget.reload_topics(topic_solver=self.topic_literals[self.topic_combo.currentIndex()],
         #                                   n_components=value, num_topic_words=self.num_topic_words_spinbox.value())
+        self.status_bar.showMessage(f"Computing topics for {value} topics")
         self.central_widget.reload_topics(topic_solver=self.topic_literals[self.topic_combo.currentIndex()],
                                           n_components=value)
         self.central_widget.generateTable()
-        self.status_bar.showMessage(f"Topics computed for {value} topics")
+
+    def closeEvent(self, event):
+        TRACER.unsubscribe(self.central_widget.on_trace)
+        self.central_widget.fit_scheduler.shutdown()
+        super().closeEvent(event)
 
     # def topic_num_topic_words_action(self, value:int):
     #     self.central_widget.reload_num_topic_words(num_topic_words=value)
@@ -270,16 +389,29 @@ class MainWindow(QMainWindow):
         # add alternatives to the menu to let user choose one from kos, nips, enron
         self.file_menu_open_kos = self.file_menu_open.addAction("KOS")
         self.file_menu_open_nips = self.file_menu_open.addAction("NIPS")
-        # self.file_menu_open_enron = self.file_menu_open.addAction("Enron")
+        self.file_menu_open_enron = self.file_menu_open.addAction("Enron")
         # self.file_menu_open_nytimes = self.file_menu_open.addAction("NYTimes")
         # self.file_menu_open_pubmed = self.file_menu_open.addAction("PubMed")
-        # connect the actions for kos and nips
+        # connect the actions for kos, nips and enron
         self.file_menu_open_kos.triggered.connect(lambda: self.open_file_action("kos"))
         self.file_menu_open_nips.triggered.connect(lambda: self.open_file_action("nips"))
-        # self.file_menu_open_enron.triggered.connect(lambda: self.open_file_action("enron"))
+        self.file_menu_open_enron.triggered.connect(lambda: self.open_file_action("enron"))
         # self.file_menu_open_nytimes.triggered.connect(lambda: self.open_file_action("nytimes"))
         # self.file_menu_open_pubmed.triggered.connect(lambda: self.open_file_action("pubmed"))
 
+        # add documents to the loaded dataset
+        self.file_menu_add = self.file_menu.addAction("Add Documents...")
+        self.file_menu_add.triggered.connect(self.add_documents_action)
+
+        # tracing of the hot paths
+        self.file_menu.addSeparator()
+        self.tracing_menu_action = self.file_menu.addAction("Trace Timings")
+        self.tracing_menu_action.setCheckable(True)
+        self.tracing_menu_action.setChecked(TRACER.enabled)
+        self.tracing_menu_action.toggled.connect(self.tracing_action)
+        self.export_trace_menu_action = self.file_menu.addAction("Export Trace...")
+        self.export_trace_menu_action.triggered.connect(self.export_trace_action)
+
         # exit action
         self.file_menu.addSeparator()
         exit_action = QAction("Exit", self)
@@ -315,10 +447,14 @@ class MainWindow(QMainWindow):
         self.num_topics_spinbox_label = LabeledWidget("Number of Topics", QSpinBox())
         self.num_topics_spinbox = self.num_topics_spinbox_label.widget
         self.num_topics_spinbox.setAccessibleName("Number of Topics")
-        self.num_topics_spinbox.setMinimum(1)
-        self.num_topics_spinbox.setMaximum(12)
+        self.num_topics_spinbox.setMinimum(MIN_TOPICS)
+        self.num_topics_spinbox.setMaximum(MAX_TOPICS)
         self.num_topics_spinbox.setValue(8)
-        self.num_topics_spinbox.valueChanged.connect(self.topic_num_topics_action)
+        self.num_topics_timer = QTimer(self)
+        self.num_topics_timer.setSingleShot(True)
+        self.num_topics_timer.setInterval(300)
+        self.num_topics_timer.timeout.connect(self.topic_num_topics_action)
+        self.num_topics_spinbox.valueChanged.connect(self.num_topics_spinbox_changed)
         self.toolbar.addSeparator()
         self.toolbar.addWidget(self.num_topics_spinbox_label)
 
@@ -0,0 +1,73 @@
+"""
+Timing comparison of the bulk docword parser against the original line by line loop.
+Run from the repository root: python -m other.bench_docwords [path to docword.*.txt]
+Without a path a synthetic corpus of the KOS size is generated into a temporary directory.
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from src.data_utils import read_docword_file
+
+
+def parse_line_by_line(docword_path):
+    # the parser used by DocumentData._load_docwords before the bulk parser
+    with open(docword_path, "r") as f:
+        n_docs = int(f.readline().strip())
+        n_words = int(f.readline().strip())
+        n_nonzero_counts = int(f.readline().strip())
+        doc_ids = np.empty(n_nonzero_counts, dtype=np.int32)
+        word_ids = np.empty(n_nonzero_counts, dtype=np.int32)
+        counts = np.empty(n_nonzero_counts, dtype=np.int32)
+        for i, line in enumerate(f):
+            split_line = line.strip().split(" ")
+            doc_ids[i] = int(split_line[0]) - 1
+            word_ids[i] = int(split_line[1]) - 1
+            counts[i] = int(split_line[2])
+
+    return (n_docs, n_words, n_nonzero_counts), doc_ids, word_ids, counts
+
+
+def write_synthetic_docword(path, n_docs=3430, n_words=6906, words_per_doc=100, seed=42):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for doc in range(n_docs):
+        words = np.unique(rng.integers(0, n_words, size=words_per_doc))
+        counts = rng.integers(1, 10, size=words.shape[0])
+        rows.append(np.column_stack([np.full(words.shape[0], doc + 1), words + 1, counts]))
+    triplets = np.concatenate(rows)
+    with open(path, "w") as f:
+        f.write(f"{n_docs}\n{n_words}\n{triplets.shape[0]}\n")
+        np.savetxt(f, triplets, fmt="%d")
+
+
+def best_of(function, path, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(path)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if len(sys.argv) > 1:
+            path = sys.argv[1]
+        else:
+            path = os.path.join(tmp_dir, "docword.synthetic.txt")
+            write_synthetic_docword(path)
+
+        loop_time, loop_result = best_of(parse_line_by_line, path)
+        bulk_time, bulk_result = best_of(read_docword_file, path)
+
+        assert loop_result[0] == bulk_result[0]
+        for loop_array, bulk_array in zip(loop_result[1:], bulk_result[1:]):
+            assert np.array_equal(loop_array, bulk_array)
+
+        print(f"{path}: {bulk_result[0][2]} nonzero counts")
+        print(f"line by line: {loop_time:.3f} s")
+        print(f"bulk parser:  {bulk_time:.3f} s ({loop_time / bulk_time:.1f}x faster)")
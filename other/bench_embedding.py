@@ -0,0 +1,69 @@
+"""
+Timing of the t-SNE and UMAP embeddings fitted from the shared kNN graph against the original fits on the full
+TF-IDF matrix. Run from the repository root: python -m other.bench_embedding [data path] [dataset name]
+Without a dataset a synthetic corpus of 10000 topic mixture documents is used.
+"""
+import sys
+import time
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfTransformer
+from sklearn.manifold import TSNE
+from umap import UMAP
+
+from src.data_utils import DIMRED_PARAMS, KNN_PARAMS, SEED, DocumentData
+from src.knn_graph import build_knn_graph, tsne_from_knn, umap_from_knn
+
+
+def synthetic_tfidf(n_docs=10000, n_words=12000, n_topics=10, words_per_doc=300, seed=42):
+    rng = np.random.default_rng(seed)
+    topic_words = rng.dirichlet(np.full(n_words, 0.05), size=n_topics)
+    doc_topics = rng.dirichlet(np.full(n_topics, 0.3), size=n_docs)
+    rows = [sparse.csr_matrix(rng.multinomial(words_per_doc, p)) for p in doc_topics @ topic_words]
+    return TfidfTransformer().fit_transform(sparse.vstack(rows).tocsr())
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def neighbourhood_preservation(tfidf, embedding, k=10, n_samples=1000):
+    # fraction of the exact k nearest neighbours in the TF-IDF space (cosine, the rows are l2 normalised)
+    # which are also among the k nearest in the embedding, averaged over a sample of the documents
+    sample = np.random.default_rng(SEED).choice(tfidf.shape[0], min(n_samples, tfidf.shape[0]), replace=False)
+    similarities = (tfidf[sample] @ tfidf.T).toarray()
+    similarities[np.arange(sample.shape[0]), sample] = -np.inf
+    exact = np.argpartition(-similarities, k, axis=1)[:, :k]
+    distances = ((embedding[sample, np.newaxis, :] - embedding[np.newaxis, :, :]) ** 2).sum(axis=2)
+    distances[np.arange(sample.shape[0]), sample] = np.inf
+    embedded = np.argpartition(distances, k, axis=1)[:, :k]
+    return np.mean([np.intersect1d(x, y).shape[0] / k for x, y in zip(exact, embedded)])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        tfidf = DocumentData(sys.argv[1], sys.argv[2]).tfidf_matrix
+    else:
+        tfidf = synthetic_tfidf()
+    print(f"{tfidf.shape[0]} documents, {tfidf.shape[1]} words, {tfidf.nnz} nonzero")
+
+    knn_time, (indices, distances) = timed(build_knn_graph, tfidf, KNN_PARAMS["n_neighbors"], random_state=SEED)
+    print(f"shared graph: {knn_time:.1f} s")
+
+    tsne_params = {"n_components": 2, "init": "random", "random_state": SEED}
+    old_tsne_time, old_tsne = timed(TSNE(**tsne_params).fit_transform, tfidf)
+    new_tsne_time, new_tsne = timed(tsne_from_knn, indices, distances,
+                                    perplexity=DIMRED_PARAMS["tsne"]["perplexity"], **tsne_params)
+    print(f"t-SNE: full TF-IDF {old_tsne_time:.1f} s, from the graph {new_tsne_time:.1f} s "
+          f"(+{knn_time:.1f} s for the graph once), "
+          f"neighbourhood preservation {neighbourhood_preservation(tfidf, old_tsne):.2f} / "
+          f"{neighbourhood_preservation(tfidf, new_tsne):.2f}")
+
+    old_umap_time, old_umap = timed(UMAP(n_components=2).fit_transform, tfidf)
+    new_umap_time, new_umap = timed(umap_from_knn, tfidf, indices, distances, n_components=2)
+    print(f"UMAP: full TF-IDF {old_umap_time:.1f} s, from the graph {new_umap_time:.1f} s, "
+          f"neighbourhood preservation {neighbourhood_preservation(tfidf, old_umap):.2f} / "
+          f"{neighbourhood_preservation(tfidf, new_umap):.2f}")
@@ -0,0 +1,55 @@
+"""
+Benchmark of the randomized truncated SVD PCA against the original full covariance eigendecomposition.
+Run from the repository root: python -m other.bench_pca [dataset name, e.g. kos]
+Without a dataset a synthetic sparse TF-IDF matrix is used (the eigendecomposition is O(words^3), so keep it small).
+"""
+import sys
+import time
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfTransformer
+
+from src.pca import randomized_pca
+
+
+def eig_pca(tfidf_matrix, n_components=2):
+    # the implementation of DocumentData._pca before the randomized SVD
+    matrix = tfidf_matrix.toarray()
+    eigenValues, eigenVectors = np.linalg.eig(np.cov(matrix.T))
+    idx = eigenValues.argsort()[::-1]
+    U = eigenVectors[:, idx][:, :n_components]
+    return (matrix @ U).astype(float)
+
+
+def synthetic_tfidf(n_docs=3000, n_words=2000, n_topics=8, words_per_doc=100, seed=42):
+    # documents drawn from a mixture of topics, so the leading principal axes are well separated
+    rng = np.random.default_rng(seed)
+    topic_words = rng.dirichlet(np.full(n_words, 0.05), size=n_topics)
+    doc_topics = rng.dirichlet(np.full(n_topics, 0.3), size=n_docs)
+    counts = np.vstack([rng.multinomial(words_per_doc, p) for p in doc_topics @ topic_words])
+    return TfidfTransformer().fit_transform(sparse.csr_matrix(counts))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        from src.data_utils import DocumentData
+        tfidf_matrix = DocumentData(data_path="data/bag+of+words", name=sys.argv[1]).tfidf_matrix
+    else:
+        tfidf_matrix = synthetic_tfidf()
+    print(f"TF-IDF matrix {tfidf_matrix.shape[0]} x {tfidf_matrix.shape[1]}, {tfidf_matrix.nnz} nonzeros")
+
+    start = time.perf_counter()
+    projection, _, _ = randomized_pca(tfidf_matrix, n_components=2, random_state=42)
+    randomized_time = time.perf_counter() - start
+    print(f"randomized SVD:     {randomized_time:.3f} s")
+
+    start = time.perf_counter()
+    reference = eig_pca(tfidf_matrix)
+    eig_time = time.perf_counter() - start
+    print(f"eigendecomposition: {eig_time:.3f} s ({eig_time / randomized_time:.1f}x slower)")
+
+    # the principal axes are only defined up to sign
+    signs = np.sign(np.sum(projection * reference, axis=0))
+    error = np.max(np.abs(projection * signs - reference)) / np.max(np.abs(reference))
+    print(f"max relative difference (up to sign): {error:.2e}")
@@ -0,0 +1,98 @@
+"""
+Startup budget check: the time of importing the application (main.py) and of a cold start to the first paint
+of the default dataset, every run in a fresh interpreter. The solver libraries (sklearn, umap, pynndescent and
+numba) are imported only on a result cache miss, so none of them may be loaded by then.
+Run from the repository root: python -m other.bench_startup [--budget 1.0] [--first-paint]
+The exit status is 1 when the import exceeds the budget or a solver library was imported.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ["sklearn", "umap", "pynndescent", "numba", "llvmlite"]
+IMPORT_BUDGET_SECONDS = 1.0
+PAINT_TIMEOUT_SECONDS = 120
+
+
+def heavy_modules() -> list:
+    return [name for name in HEAVY_MODULES if name in sys.modules]
+
+
+def run_import() -> dict:
+    start = time.perf_counter()
+    import main  # noqa: F401
+    return {"seconds": time.perf_counter() - start, "heavy_modules": heavy_modules()}
+
+
+def run_first_paint() -> dict:
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    start = time.perf_counter()
+    from PySide6.QtWidgets import QApplication
+
+    import main
+
+    app = QApplication(sys.argv)
+    global_event_filter = main.GlobalEventFilter()
+    app.installEventFilter(global_event_filter)
+    central_widget = main.CentralWidget(global_event_filter)
+    window = main.MainWindow(central_widget=central_widget)
+    deadline = time.perf_counter() + PAINT_TIMEOUT_SECONDS
+    while central_widget.scene.cloud is None and time.perf_counter() < deadline:
+        app.processEvents()
+        time.sleep(0.001)
+    app.processEvents()  # the first paint of the plot
+    seconds = time.perf_counter() - start
+    result = {"seconds": seconds, "painted": central_widget.scene.cloud is not None,
+              "heavy_modules": heavy_modules()}
+    window.close()
+    return result
+
+
+def measure(mode: str, repeat: int) -> dict:
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-m", "other.bench_startup", "--mode", mode],
+                                capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return dict(runs[-1], seconds=statistics.median(run["seconds"] for run in runs))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Startup time and lazy import check of the application")
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET_SECONDS, help="seconds allowed for the import")
+    parser.add_argument("--repeat", type=int, default=3, help="runs, the median is reported")
+    parser.add_argument("--first-paint", action="store_true",
+                        help="also time the cold start to the first paint of the default dataset (data needed)")
+    parser.add_argument("--mode", choices=["import", "paint"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode is not None:
+        print(json.dumps(run_import() if args.mode == "import" else run_first_paint()))
+        return 0
+
+    failed = False
+    result = measure("import", args.repeat)
+    print(f"import main: {result['seconds']:.3f} s (budget {args.budget:.3f} s)")
+    if result["seconds"] > args.budget:
+        print("Import budget exceeded")
+        failed = True
+    if result["heavy_modules"]:
+        print(f"Solver libraries imported on startup: {', '.join(result['heavy_modules'])}")
+        failed = True
+
+    if args.first_paint:
+        result = measure("paint", args.repeat)
+        if not result["painted"]:
+            print(f"The default dataset was not plotted within {PAINT_TIMEOUT_SECONDS} s")
+            failed = True
+        else:
+            print(f"start to first paint: {result['seconds']:.3f} s, solver libraries loaded: "
+                  f"{', '.join(result['heavy_modules']) or 'none'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""
+Peak memory of compiling a corpus and fitting its topics in memory against the out-of-core streaming pipeline.
+Run from the repository root: python -m other.bench_streaming [data path] [dataset name]
+Without a dataset a synthetic corpus is generated into a temporary directory. Every mode runs in its own process,
+so the reported peaks are not influenced by each other.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from src.data_utils import DocumentData
+from src.result_cache import ResultCache
+from src.streaming import MemoryTracker
+
+
+def write_synthetic_corpus(data_path, name="synthetic", n_docs=200000, n_words=50000, words_per_doc=100, seed=42):
+    rng = np.random.default_rng(seed)
+    with open(os.path.join(data_path, f"vocab.{name}.txt"), "w") as f:
+        f.write("\n".join(f"word{i}" for i in range(n_words)) + "\n")
+    # zipf distributed words, the unique (doc, word) pairs come out ordered by documents
+    pairs = np.repeat(np.arange(n_docs, dtype=np.int64), words_per_doc) * n_words \
+        + rng.zipf(1.3, size=n_docs * words_per_doc) % n_words
+    pairs = np.unique(pairs)
+    counts = rng.integers(1, 10, size=pairs.shape[0])
+    with open(os.path.join(data_path, f"docword.{name}.txt"), "w") as f:
+        f.write(f"{n_docs}\n{n_words}\n{pairs.shape[0]}\n")
+        for start in range(0, pairs.shape[0], 1 << 20):
+            block = slice(start, start + (1 << 20))
+            f.write("\n".join(map("{} {} {}".format, (pairs[block] // n_words + 1).tolist(),
+                                  (pairs[block] % n_words + 1).tolist(), counts[block].tolist())) + "\n")
+
+
+def run_mode(data_path, name, streaming, work_dir):
+    # the memory is sampled in the background, the peaks of the in-memory mode are inside sklearn and scipy
+    memory = MemoryTracker()
+    sampling = threading.Event()
+    sampler = threading.Thread(target=lambda: [memory.sample() for _ in iter(lambda: sampling.wait(0.01), True)])
+    sampler.start()
+    start = time.perf_counter()
+    document = DocumentData(data_path, name, corpus_dir=os.path.join(work_dir, "corpus"),
+                            result_cache=ResultCache(os.path.join(work_dir, "cache")), streaming=streaming)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    document.fit_topics("nmf", n_components=10)
+    fit_time = time.perf_counter() - start
+    sampling.set()
+    sampler.join()
+    print(f"{'streaming' if streaming else 'in memory'}: {document.n_nonzero_counts} nonzero counts, "
+          f"build {build_time:.2f} s, nmf {fit_time:.2f} s, {memory.report()}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--mode":
+        run_mode(sys.argv[2], sys.argv[3], sys.argv[4] == "streaming", sys.argv[5])
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if len(sys.argv) > 2:
+            data_path, name = sys.argv[1], sys.argv[2]
+        else:
+            data_path, name = tmp_dir, "synthetic"
+            write_synthetic_corpus(data_path, name)
+        for mode in ["memory", "streaming"]:
+            work_dir = os.path.join(tmp_dir, mode)
+            subprocess.run([sys.executable, "-m", "other.bench_streaming", "--mode", data_path, name, mode, work_dir],
+                           check=True)
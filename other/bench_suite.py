@@ -0,0 +1,183 @@
+"""
+Benchmark suite of the data and rendering hot paths: docword parsing, TF-IDF, PCA, G2, topic words, scene
+construction, table, compass selection and word cloud layout.
+Every case runs on synthetic UCI corpora of the given sizes and on the datasets found in data/bag+of+words,
+the GUI parts on the Qt offscreen platform. The timings are written as JSON (with the commit they were measured on),
+a previous result file can be compared to the current run.
+Run from the repository root: python -m other.bench_suite --sizes 1000 100000 --output bench.json [--compare old.json]
+"""
+import os
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfTransformer
+
+from other.bench_streaming import write_synthetic_corpus
+from src.data_utils import SEED, TFIDF_PARAMS, DocumentData
+from src.result_cache import ResultCache
+
+DATA_PATH = "data/bag+of+words"
+DATASETS = ["kos", "nips"]
+N_TOPICS = 10
+SELECTED_FRACTION = 0.1  # part of the documents selected for G2 and the word cloud
+
+
+def measure(function, setup=None, repeat=5) -> dict:
+    """
+    Best and median time of repeated calls, setup (not timed) runs before every call
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {"best": min(times), "median": statistics.median(times), "repeat": repeat}
+
+
+def commit_id():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_data(document: DocumentData, repeat: int) -> dict:
+    rng = np.random.default_rng(SEED)
+    cases = {}
+    cases["load_docwords"] = measure(document._load_docwords, repeat=repeat)
+    cases["tfidf"] = measure(lambda: TfidfTransformer(**TFIDF_PARAMS).fit_transform(document.doc_words_matrix),
+                             repeat=repeat)
+    with contextlib.redirect_stdout(io.StringIO()):  # _pca reports its progress
+        cases["pca"] = measure(document._pca, repeat=repeat)
+
+    # random topics, the timings of the hot paths do not depend on the quality of the fit
+    document.set_topics("nmf", rng.integers(0, N_TOPICS, size=document.n_docs), rng.random((N_TOPICS, document.n_words)))
+    document.selection.set(rng.choice(document.n_docs, int(document.n_docs * SELECTED_FRACTION), replace=False))
+    cases["compute_g2"] = measure(document.compute_g2, repeat=repeat)
+    cases["get_topics_words"] = measure(lambda: document.get_topics_words(n=10), repeat=repeat)
+    return cases
+
+
+def bench_gui(document: DocumentData, repeat: int) -> dict:
+    from PySide6.QtWidgets import QApplication, QGraphicsScene
+
+    from main import CentralWidget
+    from src.wordcloud import WordCloudWindow, normalise
+
+    app = QApplication.instance() or QApplication([])
+    cases = {}
+    central_widget = CentralWidget(SimpleNamespace(ctrl_pressed=False))
+    try:
+        document.brush = central_widget.brush
+        central_widget.document = document
+        with contextlib.redirect_stdout(io.StringIO()):
+            central_widget.document_coords = document._pca()
+        scene = central_widget.scene
+        scene.set_selection(document.selection)
+
+        def plot():
+            scene.clear()
+            scene.generateAndMapData(central_widget.document_coords, document.doc_topics, central_widget.brush)
+        cases["generateAndMapData"] = measure(plot, repeat=repeat)
+
+        model = central_widget.table_view.model
+        cases["generateTable"] = measure(central_widget.generateTable,
+                                         setup=lambda: model.set_documents(None, central_widget.brush), repeat=repeat)
+
+        # the compass in the middle of the plot, every call selects its documents anew
+        cases["get_ellipses_ids_inside_compass"] = measure(scene.get_ellipses_ids_inside_compass,
+                                                           setup=document.selection.clear, repeat=repeat)
+
+        document.selection.set(np.arange(0, document.n_docs, int(1 / SELECTED_FRACTION)))
+        window = WordCloudWindow(document)
+        g2 = normalise(document.compute_g2())
+        sorted_words = np.flip(np.argsort(g2))
+
+        def new_scene():
+            window.scene = QGraphicsScene()
+        cases["wordcloud_generate_words"] = measure(lambda: window._generate_words(sorted_words, g2),
+                                                    setup=new_scene, repeat=repeat)
+        window.close()
+        app.processEvents()
+    finally:
+        central_widget.fit_scheduler.shutdown()
+    return cases
+
+
+def bench_corpus(data_path: str, name: str, work_dir: str, repeat: int, gui: bool) -> dict:
+    start = time.perf_counter()
+    document = DocumentData(data_path, name, corpus_dir=os.path.join(work_dir, "corpus"),
+                            result_cache=ResultCache(os.path.join(work_dir, "cache")))
+    result = {"n_docs": int(document.n_docs), "n_words": int(document.n_words),
+              "n_nonzero_counts": int(document.n_nonzero_counts), "open_corpus": time.perf_counter() - start}
+    result["cases"] = bench_data(document, repeat)
+    if gui:
+        result["cases"].update(bench_gui(document, repeat))
+    return result
+
+
+def compare(previous: dict, current: dict) -> None:
+    for corpus, result in current["corpora"].items():
+        old_cases = previous.get("corpora", {}).get(corpus, {}).get("cases", {})
+        for case, timing in result["cases"].items():
+            if case in old_cases:
+                ratio = timing["best"] / old_cases[case]["best"]
+                print(f"{corpus:>16} {case:<32} {old_cases[case]['best']:9.4f} s -> {timing['best']:9.4f} s "
+                      f"({ratio:.2f}x)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark of the data and rendering hot paths")
+    parser.add_argument("--sizes", nargs="*", type=int, default=[1000, 10000, 100000],
+                        help="numbers of documents of the synthetic corpora")
+    parser.add_argument("--words", type=int, default=20000, help="vocabulary size of the synthetic corpora")
+    parser.add_argument("--words-per-doc", type=int, default=100)
+    parser.add_argument("--datasets", nargs="*", default=DATASETS, help="datasets used when present in --data-path")
+    parser.add_argument("--data-path", default=DATA_PATH)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-gui", action="store_true", help="only the data layer")
+    parser.add_argument("--output", default="bench.json")
+    parser.add_argument("--compare", help="previous result file to compare with")
+    args = parser.parse_args()
+
+    results = {"commit": commit_id(), "created": time.time(), "python": platform.python_version(),
+               "numpy": np.__version__, "machine": platform.platform(), "cpus": os.cpu_count(),
+               "repeat": args.repeat, "corpora": {}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpora = [(args.data_path, name) for name in args.datasets
+                   if os.path.exists(os.path.join(args.data_path, f"docword.{name}.txt"))]
+        for n_docs in args.sizes:
+            name = f"synthetic{n_docs}"
+            write_synthetic_corpus(tmp_dir, name, n_docs=n_docs, n_words=args.words, words_per_doc=args.words_per_doc)
+            corpora.append((tmp_dir, name))
+        for data_path, name in corpora:
+            print(f"{name}...", flush=True)
+            results["corpora"][name] = bench_corpus(data_path, name, os.path.join(tmp_dir, f"work_{name}"),
+                                                    args.repeat, not args.no_gui)
+            for case, timing in results["corpora"][name]["cases"].items():
+                print(f"{name:>16} {case:<32} {timing['best']:9.4f} s (median {timing['median']:.4f} s)")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Headless precomputation of the embeddings and topics into the result cache (./precomputed/cache), e.g. to warm the
+caches on a build machine before shipping the application. PySide6 is not imported.
+The grid datasets x dimensionality reductions x topic solvers x numbers of topics is fitted in a process pool,
+the entries already cached are skipped, so an interrupted run continues where it stopped when started again.
+
+python precompute.py --datasets kos nips --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from src.data_utils import DIMRED_PARAMS, TOPIC_PARAMS, DocumentData
+from src.fit_tasks import fit_embedding_task, fit_topics_task
+
+DATA_PATH = "data/bag+of+words"
+DATASETS = ["kos", "nips", "enron"]
+# the range of the number of topics of the application
+MIN_TOPICS = 1
+MAX_TOPICS = 12
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Fit the embeddings and topics of the datasets into the result cache")
+    parser.add_argument("--data-path", default=DATA_PATH, help="directory with the UCI vocab/docword files")
+    parser.add_argument("--datasets", nargs="+", default=DATASETS, help="dataset names")
+    parser.add_argument("--dimred", nargs="*", default=list(DIMRED_PARAMS), choices=list(DIMRED_PARAMS),
+                        help="dimensionality reductions")
+    parser.add_argument("--topics", nargs="*", default=list(TOPIC_PARAMS), choices=list(TOPIC_PARAMS),
+                        help="topic solvers")
+    parser.add_argument("--min-topics", type=int, default=MIN_TOPICS)
+    parser.add_argument("--max-topics", type=int, default=MAX_TOPICS)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) - 1),
+                        help="number of worker processes")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="BLAS/OpenMP threads of every worker (default: the CPUs divided among the workers)")
+    parser.add_argument("--dry-run", action="store_true", help="only list the entries which are not cached yet")
+    return parser.parse_args(argv)
+
+
+def missing_jobs(args: argparse.Namespace):
+    """
+    (description, function, arguments) of the grid entries which are not cached yet, the slow ones first.
+    The corpora are compiled here, once, so the workers only reopen them.
+    """
+    jobs = []
+    for name in args.datasets:
+        if not os.path.exists(os.path.join(args.data_path, f"docword.{name}.txt")):
+            print(f"Dataset {name} not found in {args.data_path}, skipped")
+            continue
+        document = DocumentData(data_path=args.data_path, name=name)
+        for solver in args.dimred:
+            if document.cached_transform(solver) is None:
+                jobs.append((f"{solver} embedding of {name}", fit_embedding_task, (args.data_path, name, solver)))
+        for n_components in range(args.max_topics, args.min_topics - 1, -1):
+            for solver in args.topics:
+                if document.cached_topics(solver, n_components=n_components) is None:
+                    jobs.append((f"{solver} with {n_components} topics of {name}", fit_topics_task,
+                                 (args.data_path, name, solver, n_components)))
+    return jobs
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    jobs = missing_jobs(args)
+    if not jobs:
+        print("Everything is cached")
+        return 0
+    if args.dry_run:
+        print("\n".join(description for description, _, _ in jobs))
+        return 0
+
+    workers = max(1, min(args.workers, len(jobs)))
+    threads = args.threads or max(1, (os.cpu_count() or 1) // workers)
+    print(f"Fitting {len(jobs)} entries in {workers} workers ({threads} threads each)")
+    start = time.perf_counter()
+    n_failed = 0
+    # spawn, the workers must not inherit the BLAS/OpenMP thread pools of this process
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        futures = {executor.submit(function, *arguments, threads): description
+                   for description, function, arguments in jobs}
+        for n_done, future in enumerate(as_completed(futures), start=1):
+            description = futures[future]
+            try:
+                future.result()
+                status = "done"
+            except Exception as e:
+                n_failed += 1
+                status = f"failed: {e}"
+            print(f"[{n_done}/{len(jobs)}] {description} {status} (after {time.perf_counter() - start:.0f} s)")
+    except KeyboardInterrupt:
+        executor.shutdown(wait=False, cancel_futures=True)
+        # the running fits are abandoned, only whole results are ever stored into the cache
+        for process in multiprocessing.active_children():
+            process.terminate()
+        print("Interrupted, the finished entries are cached, run again to continue")
+        return 130
+    executor.shutdown()
+    print(f"Finished in {time.perf_counter() - start:.0f} s, {n_failed} failed")
+    return 1 if n_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
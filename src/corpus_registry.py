@@ -0,0 +1,110 @@
+import mmap
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+from scipy import sparse
+
+from src.corpus_store import source_stamp
+from src.data_utils import DocumentData
+from src.tracing import traced
+
+CORPUS_REGISTRY_MAX_BYTES = 1024 ** 3
+
+
+def _is_memory_mapped(array: np.ndarray) -> bool:
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
+
+def resident_bytes(value) -> int:
+    """
+    Bytes of the arrays held by value (a DocumentData, sparse matrix, array or a container of them).
+    Arrays memory-mapped from the compiled corpus are not counted, their pages are the OS's to drop.
+    """
+    if isinstance(value, DocumentData):
+        return resident_bytes(list(vars(value).values()))
+    if sparse.issparse(value):
+        return resident_bytes([value.data, value.indices, value.indptr])
+    if isinstance(value, np.ndarray):
+        return 0 if _is_memory_mapped(value) else value.nbytes
+    if isinstance(value, dict):
+        return resident_bytes(list(value.values()))
+    if isinstance(value, (list, tuple)):
+        return sum(resident_bytes(item) for item in value if not isinstance(item, str))
+    return 0
+
+
+class CorpusRegistry():
+    """
+    Process wide LRU of the loaded datasets, switching back to a recently used dataset (or only changing its
+    embedding) reuses its DocumentData with the TF-IDF, the looked up embeddings and topics and the added documents.
+    When the loaded datasets hold more than max_bytes the least recently used ones are dropped.
+    """
+    def __init__(self, max_bytes: int = CORPUS_REGISTRY_MAX_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.documents = OrderedDict()  # (data_path, name) -> (DocumentData, source stamp), the last used last
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def __contains__(self, key) -> bool:
+        return key in self.documents
+
+    @traced("corpus registry get")
+    def get(self, data_path: str, name: str) -> DocumentData:
+        """
+        The loaded dataset, loaded now if it is not registered or its source files have changed
+        """
+        key = (data_path, name)
+        entry = self.documents.get(key)
+        if entry is not None:
+            document, stamp = entry
+            if stamp == source_stamp(document.vocab_path, document.docword_path):
+                self.hits += 1
+                self.documents.move_to_end(key)
+                self.evict(keep=key)
+                return document
+            del self.documents[key]
+
+        self.misses += 1
+        document = DocumentData(data_path=data_path, name=name)
+        self.documents[key] = (document, source_stamp(document.vocab_path, document.docword_path))
+        self.evict(keep=key)
+        return document
+
+    def discard(self, data_path: str, name: str) -> None:
+        self.documents.pop((data_path, name), None)
+
+    def clear(self) -> None:
+        self.documents.clear()
+
+    def evict(self, keep: Optional[tuple] = None) -> None:
+        """
+        Drop the least recently used datasets until the rest fits into max_bytes
+        """
+        sizes = {key: resident_bytes(document) for key, (document, _) in self.documents.items()}
+        total_bytes = sum(sizes.values())
+        for key in list(self.documents):
+            if total_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            del self.documents[key]
+            total_bytes -= sizes[key]
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / requests if requests else 0.0, "datasets": len(self.documents),
+                "bytes": sum(resident_bytes(document) for document, _ in self.documents.values())}
+
+
+CORPUS_REGISTRY = CorpusRegistry()
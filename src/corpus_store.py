@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, List, Optional
+
+import numpy as np
+
+CORPUS_DIR = "./precomputed/corpus"
+CORPUS_FORMAT_VERSION = 1
+ARRAY_NAMES = ["counts_indptr", "counts_indices", "counts_data", "tfidf_data", "idf", "term_totals",
+               "vocab_offsets", "vocab_blob"]
+OPTIONAL_ARRAY_NAMES = ["tfidf_indptr", "tfidf_indices"]  # only stored if the TF-IDF sparsity differs from counts
+
+
+class MappedVocabulary():
+    """
+    Read-only vocabulary stored as one utf-8 blob plus word offsets, words are decoded on access
+    """
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray) -> None:
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self) -> int:
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(self, idx) -> str:
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        idx = int(idx)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("vocabulary index out of range")
+        return self.blob[self.offsets[idx]:self.offsets[idx + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+def encode_vocabulary(vocabulary: List[str]):
+    """
+    Encode the list of words into the offsets + blob arrays
+    """
+    encoded = [word.encode("utf-8") for word in vocabulary]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(word) for word in encoded], out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return offsets, blob
+
+
+def source_stamp(*paths: str) -> Dict[str, List[int]]:
+    """
+    Size and modification time of the source text files, the compiled corpus is rebuilt when they change
+    """
+    stamp = {}
+    for path in paths:
+        stat = os.stat(path)
+        stamp[os.path.basename(path)] = [stat.st_size, stat.st_mtime_ns]
+    return stamp
+
+
+def fingerprint_arrays(*arrays: np.ndarray) -> str:
+    """
+    Content hash of the given arrays (dtype, shape and data)
+    """
+    digest = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(f"{array.dtype.str}{array.shape}".encode())
+        digest.update(memoryview(array).cast("B"))
+    return digest.hexdigest()
+
+
+class CorpusWriter():
+    """
+    Writes the compiled corpus array by array into a temporary directory which is renamed by commit,
+    so a crashed write never leaves a half written corpus behind.
+    Large arrays can be created as memory-mapped files and filled in place, piece by piece.
+    """
+    def __init__(self, corpus_dir: str) -> None:
+        self.corpus_dir = corpus_dir
+        self.tmp_dir = f"{corpus_dir}.tmp-{os.getpid()}"
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.tmp_dir, f"{name}.npy")
+
+    def save(self, name: str, array: np.ndarray) -> None:
+        np.save(self._path(name), array)
+
+    def create(self, name: str, shape, dtype) -> np.memmap:
+        return np.lib.format.open_memmap(self._path(name), mode="w+", dtype=dtype, shape=shape)
+
+    def shrink(self, name: str, length: int, block: int = 1 << 24) -> np.memmap:
+        """
+        Cut a created array to its first length items (copied block by block)
+        """
+        array = np.load(self._path(name), mmap_mode="r")
+        if array.shape[0] == length:
+            return array
+        shrunk = np.lib.format.open_memmap(self._path(f"{name}.shrink"), mode="w+", dtype=array.dtype,
+                                           shape=(length,) + array.shape[1:])
+        for start in range(0, length, block):
+            shrunk[start:start + block] = array[start:min(start + block, length)]
+        shrunk.flush()
+        del array, shrunk
+        os.replace(self._path(f"{name}.shrink"), self._path(name))
+        return np.load(self._path(name), mmap_mode="r")
+
+    def commit(self, meta: dict) -> None:
+        try:
+            with open(os.path.join(self.tmp_dir, "meta.json"), "w") as f:
+                json.dump(dict(meta, version=CORPUS_FORMAT_VERSION), f, indent=2)
+            shutil.rmtree(self.corpus_dir, ignore_errors=True)
+            os.rename(self.tmp_dir, self.corpus_dir)
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self) -> None:
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+def write_corpus(corpus_dir: str, arrays: Dict[str, np.ndarray], meta: dict) -> None:
+    """
+    Write the compiled corpus from the in-memory arrays
+    """
+    writer = CorpusWriter(corpus_dir)
+    try:
+        for name, array in arrays.items():
+            writer.save(name, array)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.commit(meta)
+
+
+def open_corpus(corpus_dir: str, expected_meta: dict) -> Optional[Dict[str, object]]:
+    """
+    Memory-map the compiled corpus. Returns None if it does not exist or if any of the expected
+    meta values (source stamp, TF-IDF settings...) differs, then the corpus has to be rebuilt.
+    """
+    try:
+        with open(os.path.join(corpus_dir, "meta.json"), "r") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != CORPUS_FORMAT_VERSION:
+        return None
+    for key, value in expected_meta.items():
+        if meta.get(key) != value:
+            return None
+
+    corpus = {"meta": meta}
+    try:
+        for name in ARRAY_NAMES:
+            corpus[name] = np.load(os.path.join(corpus_dir, f"{name}.npy"), mmap_mode="r")
+        for name in OPTIONAL_ARRAY_NAMES:
+            path = os.path.join(corpus_dir, f"{name}.npy")
+            if os.path.exists(path):
+                corpus[name] = np.load(path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+
+    corpus["vocabulary"] = MappedVocabulary(corpus["vocab_offsets"], corpus["vocab_blob"])
+    return corpus
@@ -1,96 +1,534 @@
 import os
-from typing import List, Literal, Union
+from typing import Dict, List, Literal, Optional, Tuple, Union
 
 import numpy as np
-from sklearn.decomposition import NMF, LatentDirichletAllocation
-from sklearn.feature_extraction.text import TfidfTransformer
-# from sklearn.decomposition import PCA  # TODO write own
-from sklearn.manifold import TSNE
-from umap import UMAP
+from scipy import sparse
+
+from src.corpus_store import (CORPUS_DIR, encode_vocabulary, fingerprint_arrays,
+                              open_corpus, source_stamp, write_corpus)
+from src.knn_graph import build_knn_graph, tsne_from_knn, umap_from_knn
+from src.out_of_sample import interpolate_embedding, lda_fold_in, nmf_fold_in, tfidf_rows
+from src.pca import randomized_pca
+from src.result_cache import DEFAULT_RESULT_CACHE, ResultCache
+from src.selection import DocumentSelection
+from src.tracing import span, traced
 
 SEED = 42
+COUNT_DTYPE = np.int32  # word counts of the UCI corpora fit easily into int32
+DOCWORD_CHUNK_BYTES = 1 << 26  # parse the docword files in 64 MB blocks
+TFIDF_PARAMS = {}  # TfidfTransformer settings, part of the compiled corpus identity
+# solver settings, all of them are part of the result cache keys
+# t-SNE and UMAP are fitted from one shared kNN graph of the TF-IDF (see src/knn_graph.py),
+# t-SNE needs 3 * perplexity + 1 neighbours
+KNN_PARAMS = {"n_neighbors": 91, "metric": "euclidean", "random_state": SEED}
+DIMRED_PARAMS = {
+    "pca": {"n_components": 2, "algorithm": "randomized_svd", "n_oversamples": 20, "n_iter": 7},
+    "tsne": {"n_components": 2, "init": "random", "random_state": SEED, "perplexity": 30.0, "knn": KNN_PARAMS},
+    "umap": {"n_components": 2, "n_neighbors": 15, "knn": KNN_PARAMS},
+}
+TOPIC_PARAMS = {
+    "nmf": {"random_state": SEED, "input": "tfidf"},
+    "lda": {"random_state": SEED, "input": "counts"},
+}
+# corpora with larger docword files are compiled and fitted out-of-core (see src/streaming.py)
+STREAMING_DOCWORD_BYTES = 1 << 30
+STREAMING_TOPIC_PARAMS = {
+    "nmf": {"random_state": SEED, "input": "tfidf", "algorithm": "minibatch"},
+    "lda": {"random_state": SEED, "input": "counts", "learning_method": "online"},
+}
+TOPIC_INDEX_WORDS = 100  # number of the best words of every topic stored with the topics
+# the results shipped in ./precomputed were computed with these settings
+LEGACY_RESULT_DIR = "./precomputed"
+LEGACY_RESULT_PARAMS = [
+    {"n_components": 2, "algorithm": "eig", "kind": "dimred", "solver": "pca", "tfidf": {}},
+    {"n_components": 2, "init": "random", "random_state": 42, "kind": "dimred", "solver": "tsne", "tfidf": {}},
+    {"n_components": 2, "kind": "dimred", "solver": "umap", "tfidf": {}},
+] + [
+    {"random_state": 42, "input": input_matrix, "kind": "topics", "solver": solver, "n_components": n_components,
+     "tfidf": {}}
+    for solver, input_matrix in [("nmf", "tfidf"), ("lda", "counts")] for n_components in range(1, 13)
+]
+
+
+def read_docword_header(f) -> Tuple[int, int, int]:
+    """
+    Read the three header lines (number of documents, words and nonzero counts) of the UCI docword file
+    """
+    n_docs = int(f.readline().strip())
+    n_words = int(f.readline().strip())
+    n_nonzero_counts = int(f.readline().strip())
+    return n_docs, n_words, n_nonzero_counts
+
+
+def read_docword_file(docword_path: str, chunk_bytes: int = DOCWORD_CHUNK_BYTES):
+    """
+    Parse the body of the UCI docword file in large blocks instead of line by line.
+    Returns the header and zero based doc ids, word ids and counts, validated against the header.
+    """
+    with open(docword_path, "rb") as f:
+        n_docs, n_words, n_nonzero_counts = read_docword_header(f)
+
+        # all the values are stored flat as (doc, word, count) triplets
+        triplets = np.empty(3 * n_nonzero_counts, dtype=np.int32)
+        n_values = 0
+        rest = b""
+        while True:
+            block = f.read(chunk_bytes)
+            if not block:
+                break
+            block = rest + block
+            # only parse complete lines, the rest is prepended to the next block
+            last_newline = block.rfind(b"\n")
+            if last_newline == -1:
+                rest = block
+                continue
+            rest = block[last_newline + 1:]
+            n_values = _parse_values(block[:last_newline + 1], triplets, n_values, docword_path)
+        if rest.strip():
+            n_values = _parse_values(rest, triplets, n_values, docword_path)
+
+    if n_values != triplets.shape[0]:
+        raise ValueError(f"{docword_path}: expected {n_nonzero_counts} nonzero counts, found {n_values / 3:g}")
+    triplets = triplets.reshape(-1, 3)
+    doc_ids = triplets[:, 0] - 1
+    word_ids = triplets[:, 1] - 1
+    counts = triplets[:, 2].astype(COUNT_DTYPE, copy=False)
+    if n_nonzero_counts and (doc_ids.min() < 0 or doc_ids.max() >= n_docs):
+        raise ValueError(f"{docword_path}: document ids out of the range 1..{n_docs}")
+    if n_nonzero_counts and (word_ids.min() < 0 or word_ids.max() >= n_words):
+        raise ValueError(f"{docword_path}: word ids out of the range 1..{n_words}")
+    if n_nonzero_counts and counts.min() <= 0:
+        raise ValueError(f"{docword_path}: counts have to be positive")
+
+    return (n_docs, n_words, n_nonzero_counts), doc_ids, word_ids, counts
+
+
+def _parse_values(block: bytes, out: np.ndarray, n_values: int, docword_path: str) -> int:
+    values = np.fromstring(block, dtype=np.int32, sep=" ")  # any whitespace (newlines too) separates numbers
+    if n_values + values.shape[0] > out.shape[0]:
+        raise ValueError(f"{docword_path}: more nonzero counts than declared in the header ({out.shape[0] // 3})")
+    out[n_values:n_values + values.shape[0]] = values
+    return n_values + values.shape[0]
+
+
+def g2_keyness(term_counts_selected: np.ndarray, term_counts_unselected: np.ndarray,
+               total_term_counts: np.ndarray, sum_word_counts: int) -> np.ndarray:
+    """
+    Vectorized G2 (log-likelihood) of every word, comparing the selected part of the corpus to the unselected one
+    """
+    total_words_selected = np.sum(term_counts_selected)
+    total_words_unselected = np.sum(term_counts_unselected)
+
+    expected_value_selected = (total_term_counts * total_words_selected + 1) / sum_word_counts
+    expected_value_unselected = (total_term_counts * total_words_unselected + 1) / sum_word_counts
+    return 2 * (term_counts_selected * np.log((term_counts_selected + 1) / expected_value_selected) +
+                term_counts_unselected * np.log((term_counts_unselected + 1) / expected_value_unselected))
+
+
+def build_topic_index(topics: np.ndarray, n: int = TOPIC_INDEX_WORDS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Index of the topics x words matrix: the ids of the n best words of every topic (sorted from the best)
+    and the best topic of every word
+    """
+    n = min(n, topics.shape[1])
+    top_words = np.argpartition(topics, -n, axis=1)[:, -n:]
+    # sort the selected words by their weight, descending
+    order = np.argsort(-np.take_along_axis(topics, top_words, axis=1), axis=1, kind="stable")
+    top_words = np.take_along_axis(top_words, order, axis=1).astype(np.int32)
+    word_best_topic = np.argmax(topics, axis=0).astype(np.int32)
+    return top_words, word_best_topic
+
 
 class DocumentData():
     """
     Class to load and process the data from the document files
     """
-    def __init__(self, data_path:str, name:str) -> None:
+    def __init__(self, data_path:str, name:str, corpus_dir:str = CORPUS_DIR,
+                 result_cache: Optional[ResultCache] = None, streaming: Optional[bool] = None) -> None:
         self.name = name
+        self.data_path = data_path
         self.vocab_path = os.path.join(data_path, f"vocab.{self.name}.txt")
         self.docword_path = os.path.join(data_path, f"docword.{self.name}.txt")
-        self.vocabulary = self._load_vocabulary()
-        self.doc_words_matrix = self._load_docwords()
-        self.total_term_counts = self._total_term_counts(self.doc_words_matrix)
+        self.corpus_path = os.path.join(corpus_dir, self.name) if corpus_dir else None
+        # out-of-core processing (needs the compiled corpus on disk), by default for the large corpora only
+        if streaming is None:
+            streaming = os.path.getsize(self.docword_path) > STREAMING_DOCWORD_BYTES
+        self.streaming = streaming and self.corpus_path is not None
+        self.result_cache = result_cache if result_cache is not None else DEFAULT_RESULT_CACHE
+        # embeddings and topics looked up in the result cache, kept while this object lives (see CorpusRegistry)
+        self.results = {}
+        with span("open corpus", dataset=name):
+            opened = self._open_corpus()
+        if not opened:
+            with span("build corpus", dataset=name):
+                self._build_corpus()
+        # the solvers are fitted on the documents of the corpus, documents added later are only projected
+        self.n_corpus_docs = self.n_docs
         self.sum_word_counts = np.sum(self.total_term_counts)
         #self.document_words_sum = self._number_of_words_per_doc(self.doc_words_matrix)
-        self.tfidf_matrix = TfidfTransformer().fit_transform(self.doc_words_matrix)
-        self.selected_documents = []
         self.doc_topics = None
         self.topics = None
         self.topics_method = None
+        self.top_words = None  # (topics, TOPIC_INDEX_WORDS) best words of every topic
+        self.word_best_topic = None  # best topic of every word
+        # the selection shared with the scene and the table, its statistics are updated by the selection deltas
+        self.selection = DocumentSelection(self.n_docs)
+        self.selection.subscribe(self.update_selection)
+        self.selected_term_counts = np.zeros(self.n_words, dtype=np.int64)
+        self.selected_topic_counts = None
+
+    def _corpus_meta(self) -> dict:
+        return {"name": self.name,
+                "sources": source_stamp(self.vocab_path, self.docword_path),
+                "tfidf": TFIDF_PARAMS}
+
+    def _open_corpus(self) -> bool:
+        """
+        Reopen the compiled binary corpus (memory-mapped), returns False if it is missing or stale
+        """
+        if self.corpus_path is None:
+            return False
+        corpus = open_corpus(self.corpus_path, self._corpus_meta())
+        if corpus is None:
+            return False
+
+        meta = corpus["meta"]
+        self.n_docs, self.n_words, self.n_nonzero_counts = meta["n_docs"], meta["n_words"], meta["n_nonzero_counts"]
+        self.fingerprint = meta["fingerprint"]
+        self.vocabulary = corpus["vocabulary"]
+        shape = (self.n_docs, self.n_words)
+        self.doc_words_matrix = sparse.csr_matrix(
+            (corpus["counts_data"], corpus["counts_indices"], corpus["counts_indptr"]), shape=shape, copy=False)
+        self.tfidf_matrix = sparse.csr_matrix(
+            (corpus["tfidf_data"], corpus.get("tfidf_indices", corpus["counts_indices"]),
+             corpus.get("tfidf_indptr", corpus["counts_indptr"])), shape=shape, copy=False)
+        self.idf = corpus["idf"]
+        self.total_term_counts = corpus["term_totals"]
+        return True
+
+    def _build_corpus(self) -> None:
+        """
+        Parse the text files, fit the TF-IDF and write the result as the compiled binary corpus
+        """
+        if self.streaming:
+            self._build_corpus_streaming()
+            return
+        with span("parse vocabulary"):
+            self.vocabulary = self._load_vocabulary()
+        with span("parse docwords"):
+            self.doc_words_matrix = self._load_docwords()
+        self.total_term_counts = self._total_term_counts(self.doc_words_matrix)
+        with span("tfidf"):
+            from sklearn.feature_extraction.text import TfidfTransformer
+
+            tfidf = TfidfTransformer(**TFIDF_PARAMS)
+            self.tfidf_matrix = tfidf.fit_transform(self.doc_words_matrix).tocsr()
+            self.tfidf_matrix.sort_indices()
+            self.idf = tfidf.idf_ if tfidf.use_idf else np.ones(self.n_words)
+        vocab_offsets, vocab_blob = encode_vocabulary(self.vocabulary)
+        counts = self.doc_words_matrix
+        self.fingerprint = fingerprint_arrays(counts.indptr, counts.indices, counts.data, vocab_offsets, vocab_blob)
+        if self.corpus_path is None:
+            return
+
+        arrays = {"counts_indptr": counts.indptr, "counts_indices": counts.indices, "counts_data": counts.data,
+                  "tfidf_data": self.tfidf_matrix.data, "idf": self.idf, "term_totals": self.total_term_counts,
+                  "vocab_offsets": vocab_offsets, "vocab_blob": vocab_blob}
+        if not (np.array_equal(self.tfidf_matrix.indptr, counts.indptr)
+                and np.array_equal(self.tfidf_matrix.indices, counts.indices)):
+            arrays["tfidf_indptr"] = self.tfidf_matrix.indptr
+            arrays["tfidf_indices"] = self.tfidf_matrix.indices
+        meta = dict(self._corpus_meta(), n_docs=self.n_docs, n_words=self.n_words,
+                    n_nonzero_counts=self.n_nonzero_counts, fingerprint=self.fingerprint)
+        try:
+            os.makedirs(os.path.dirname(self.corpus_path), exist_ok=True)
+            with span("write corpus"):
+                write_corpus(self.corpus_path, arrays, meta)
+        except OSError as e:
+            print(f"Compiled corpus could not be written to {self.corpus_path}: {e}")
+
+    def _build_corpus_streaming(self) -> None:
+        """
+        Compile the corpus chunk by chunk straight into the memory-mapped files and open it
+        """
+        from src.streaming import MemoryTracker, build_corpus_streaming  # only the large corpora need it
+
+        memory = MemoryTracker()
+        vocab_offsets, vocab_blob = encode_vocabulary(self._load_vocabulary())
+        os.makedirs(os.path.dirname(self.corpus_path), exist_ok=True)
+        build_corpus_streaming(self.docword_path, self.corpus_path, vocab_offsets, vocab_blob, self._corpus_meta(),
+                               memory=memory)
+        if not self._open_corpus():
+            raise RuntimeError(f"Compiled corpus {self.corpus_path} could not be opened")
+        print(f"Corpus {self.name} compiled out-of-core, {memory.report()}")
+
+    def _cached_result(self, params: dict, legacy_files: Dict[str, str], legacy_shapes: Dict[str, tuple]):
+        """
+        Look the result up in the result cache. The results shipped in ./precomputed (keyed only by the dataset
+        name) are adopted into the cache when they were computed with the same parameters and match the shapes.
+        """
+        key = self.result_cache.key(self.fingerprint, params)
+        if key in self.results:
+            return self.results[key]
+        arrays = self.result_cache.get(key)
+        if arrays is not None:
+            self.results[key] = arrays
+            return arrays
+        if params not in LEGACY_RESULT_PARAMS:
+            return None
+
+        arrays = {}
+        for name, file_name in legacy_files.items():
+            path = os.path.join(LEGACY_RESULT_DIR, file_name)
+            if not os.path.exists(path):
+                return None
+            arrays[name] = np.load(path)
+            if arrays[name].shape != legacy_shapes[name]:
+                return None
+        self._store_result(params, arrays)
+        return arrays
+
+    def _store_result(self, params: dict, arrays: Dict[str, np.ndarray]) -> None:
+        key = self.result_cache.key(self.fingerprint, params)
+        try:
+            self.result_cache.put(key, arrays, {"dataset": self.name, "fingerprint": self.fingerprint, "params": params})
+        except OSError as e:
+            print(f"Result could not be cached: {e}")
+
+    def _dimred_params(self, solver: str) -> dict:
+        return dict(DIMRED_PARAMS[solver], kind="dimred", solver=solver, tfidf=TFIDF_PARAMS)
+
+    def _topic_params(self, solver: str, n_components: int) -> dict:
+        params = STREAMING_TOPIC_PARAMS if self.streaming else TOPIC_PARAMS
+        return dict(params[solver], kind="topics", solver=solver, n_components=n_components, tfidf=TFIDF_PARAMS)
+
+    @traced()
+    def cached_transform(self, solver: Union[Literal["pca"], Literal["umap"], Literal["tsne"]]) -> Optional[np.ndarray]:
+        """
+        Return the embedding if it is already cached, None otherwise (nothing is computed)
+        """
+        if solver not in DIMRED_PARAMS:
+            raise ValueError("Invalid solver")
 
+        cached = self._cached_result(self._dimred_params(solver), {"embedding": f"{self.name}_{solver}.npy"},
+                                     {"embedding": (self.n_corpus_docs, 2)})
+        return self.extend_embedding(solver, cached["embedding"]) if cached is not None else None
+
+    @traced()
     def fit_transform(self, solver: Union[Literal["pca"], Literal["umap"], Literal["tsne"]]):
         """
         Fit and transform the data using the specified solver
         """
+        embedding = self.cached_transform(solver)
+        if embedding is not None:
+            return embedding
+
+        arrays = {}
         if solver == "pca":
-            try:
-                #assert False
-                pca_res = np.load(f"./precomputed/{self.name}_pca.npy")
-            except:
-                pca_res = self._pca()
-                np.save(f"./precomputed/{self.name}_pca.npy", pca_res) #we do not need to precompute PCA
-
-            return pca_res
+            embedding = self._pca()
+            arrays["components"] = self.pca_components  # projects the documents added later
         elif solver == "tsne":
-            try:
-                tsne_res = np.load(f"./precomputed/{self.name}_tsne.npy")
-            except:
-                tsne_res = TSNE(n_components=2, init="random", random_state=SEED).fit_transform(self.tfidf_matrix)
-                np.save(f"./precomputed/{self.name}_tsne.npy", tsne_res)
-
-            return tsne_res
-        elif solver == "umap":
-            try:
-                umap_res = np.load(f"./precomputed/{self.name}_umap.npy")
-            except:
-                umap_res = UMAP(n_components=2).fit_transform(self.tfidf_matrix)
-                np.save(f"./precomputed/{self.name}_umap.npy", umap_res)
-
-            return umap_res
+            params = DIMRED_PARAMS["tsne"]
+            indices, distances = self.knn_graph()
+            embedding = tsne_from_knn(indices, distances, perplexity=params["perplexity"],
+                                      random_state=params["random_state"], n_components=params["n_components"],
+                                      init=params["init"])
+        else:
+            params = DIMRED_PARAMS["umap"]
+            indices, distances = self.knn_graph()
+            embedding = umap_from_knn(self._corpus_rows(self.tfidf_matrix), indices, distances,
+                                      n_neighbors=params["n_neighbors"], n_components=params["n_components"])
+        self._store_result(self._dimred_params(solver), dict(arrays, embedding=embedding))
+
+        return self.extend_embedding(solver, embedding)
+
+    @traced()
+    def extend_embedding(self, solver: Union[Literal["pca"], Literal["umap"], Literal["tsne"]],
+                         embedding: np.ndarray) -> np.ndarray:
+        """
+        Append the coordinates of the documents added after the embedding was fitted: projected onto the PCA axes,
+        interpolated from the nearest corpus documents for t-SNE and UMAP (and for PCA cached without its axes)
+        """
+        n_known = embedding.shape[0]
+        if n_known >= self.n_docs:
+            return embedding
+        added = self.tfidf_matrix[n_known:]
+        cached = self.result_cache.get(self.result_cache.key(self.fingerprint, self._dimred_params(solver)))
+        if solver == "pca" and cached is not None and "components" in cached:
+            projected = np.asarray(added @ cached["components"].T)
         else:
+            projected = interpolate_embedding(embedding[:self.n_corpus_docs], self._corpus_rows(self.tfidf_matrix),
+                                              added)
+        return np.vstack([embedding, projected])
+
+    @traced()
+    def knn_graph(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The (cached) nearest neighbours graph of the documents shared by the embeddings,
+        the neighbour indices and distances of every document
+        """
+        params = dict(KNN_PARAMS, kind="knn", tfidf=TFIDF_PARAMS)
+        cached = self.result_cache.get(self.result_cache.key(self.fingerprint, params))
+        if cached is None:
+            indices, distances = build_knn_graph(self._corpus_rows(self.tfidf_matrix), KNN_PARAMS["n_neighbors"],
+                                                 metric=KNN_PARAMS["metric"], random_state=KNN_PARAMS["random_state"])
+            cached = {"indices": indices.astype(np.int32), "distances": distances.astype(np.float32)}
+            self._store_result(params, cached)
+        return cached["indices"], cached["distances"]
+
+    @traced()
+    def cached_topics(self, solver: Union[Literal["nmf"], Literal["lda"]], n_components:int = 10):
+        """
+        Return the (doc_topics, topics, top_words, word_best_topic) tuple if it is already cached,
+        None otherwise (nothing is fitted)
+        """
+        if solver not in TOPIC_PARAMS:
             raise ValueError("Invalid solver")
-        
+
+        prefix = f"{self.name}_{solver}_{n_components}"
+        params = self._topic_params(solver, n_components)
+        cached = self._cached_result(params,
+                                     {"doc_topics": f"{prefix}_doc_topics.npy", "topics": f"{prefix}_topics.npy"},
+                                     {"doc_topics": (self.n_corpus_docs,), "topics": (n_components, self.n_words)})
+        if cached is None:
+            return None
+        if "top_words" not in cached:
+            # entries adopted from ./precomputed get their word index once
+            cached["top_words"], cached["word_best_topic"] = build_topic_index(cached["topics"])
+            self._store_result(params, cached)
+        return cached["doc_topics"], cached["topics"], cached["top_words"], cached["word_best_topic"]
+
+    @traced()
     def fit_topics(self, solver: Union[Literal["nmf"], Literal["lda"]], n_components:int = 10):
         """
         Fit the topics using the specified solver
         """
-        if solver == "nmf":
-            try:
-                doc_topics = np.load(f"./precomputed/{self.name}_nmf_{n_components}_doc_topics.npy")
-                topics = np.load(f"./precomputed/{self.name}_nmf_{n_components}_topics.npy")
-            except:
+        cached = self.cached_topics(solver, n_components)
+        if cached is None:
+            if self.streaming:
+                doc_topics, topics = self._fit_topics_streaming(solver, n_components=n_components)
+            elif solver == "nmf":
                 doc_topics, topics = self._nmf(n_components=n_components)
-                np.save(f"./precomputed/{self.name}_nmf_{n_components}_doc_topics.npy", doc_topics)
-                np.save(f"./precomputed/{self.name}_nmf_{n_components}_topics.npy", topics)
-            self.doc_topics = doc_topics
-            self.topics = topics
-            self.topics_method = solver
-        elif solver == "lda":
-            try:
-                doc_topics = np.load(f"./precomputed/{self.name}_lda_{n_components}_doc_topics.npy")
-                topics = np.load(f"./precomputed/{self.name}_lda_{n_components}_topics.npy")
-            except:
+            else:
                 doc_topics, topics = self._lda(n_components=n_components)
-                np.save(f"./precomputed/{self.name}_lda_{n_components}_doc_topics.npy", doc_topics)
-                np.save(f"./precomputed/{self.name}_lda_{n_components}_topics.npy", topics)
+            top_words, word_best_topic = build_topic_index(topics)
+            cached = doc_topics, topics, top_words, word_best_topic
+            self._store_result(self._topic_params(solver, n_components),
+                               {"doc_topics": doc_topics, "topics": topics, "top_words": top_words,
+                                "word_best_topic": word_best_topic})
 
-            self.doc_topics = doc_topics
-            self.topics = topics
-            self.topics_method = solver
-        else:
-            raise ValueError("Invalid solver")
+        self.set_topics(solver, *cached)
 
+    @traced()
+    def set_topics(self, solver: Union[Literal["nmf"], Literal["lda"]], doc_topics: np.ndarray, topics: np.ndarray,
+                   top_words: Optional[np.ndarray] = None, word_best_topic: Optional[np.ndarray] = None):
+        """
+        Use topics fitted elsewhere (e.g. in a background worker), the word index is built if not given.
+        The documents added after the topics were fitted are folded into them.
+        """
+        if top_words is None or word_best_topic is None:
+            top_words, word_best_topic = build_topic_index(topics)
+        if doc_topics.shape[0] < self.n_docs:
+            doc_topics = np.concatenate([doc_topics, self._fold_in_topics(solver, topics, doc_topics.shape[0])])
+        self.doc_topics = doc_topics
+        self.topics = topics
+        self.top_words = top_words
+        self.word_best_topic = word_best_topic
+        self.topics_method = solver
+        self.selected_topic_counts = np.bincount(self.doc_topics[self.selection.mask], minlength=self.topics.shape[0])
+
+    def clear_topics(self) -> None:
+        """
+        Drop the current topics (e.g. when the loaded data is shown anew), until set_topics there are none
+        """
+        self.doc_topics = None
+        self.topics = None
+        self.topics_method = None
+        self.top_words = None
+        self.word_best_topic = None
+        self.selected_topic_counts = None
+
+    def _fold_in_topics(self, solver: str, topics: np.ndarray, start: int) -> np.ndarray:
+        # best topics of the documents from start on, the topics stay fixed
+        if solver == "nmf":
+            return nmf_fold_in(self.tfidf_matrix[start:], topics)
+        return lda_fold_in(self.doc_words_matrix[start:], topics)
+
+    def load_documents(self, docword_path: str) -> sparse.csr_matrix:
+        """
+        Read new documents from a UCI docword file over the vocabulary of this corpus (its documents numbered from 1)
+        """
+        (n_docs, n_words, _), doc_ids, word_ids, counts = read_docword_file(docword_path)
+        if n_words != self.n_words:
+            raise ValueError(f"{docword_path}: {n_words} words, the vocabulary of {self.name} has {self.n_words}")
+        counts_matrix = sparse.coo_matrix((counts, (doc_ids, word_ids)), shape=(n_docs, n_words)).tocsr()
+        counts_matrix.sort_indices()
+        return counts_matrix
+
+    @traced()
+    def add_documents(self, counts: sparse.csr_matrix) -> np.ndarray:
+        """
+        Append the documents (word counts over the vocabulary) without refitting anything: their TF-IDF uses the
+        idf of the corpus and they are folded into the current topics. Returns the ids of the new documents,
+        the embeddings are extended by extend_embedding.
+        """
+        counts = sparse.csr_matrix(counts, dtype=COUNT_DTYPE)
+        if counts.shape[1] != self.n_words:
+            raise ValueError(f"The documents have {counts.shape[1]} words, the vocabulary has {self.n_words}")
+        new_ids = np.arange(self.n_docs, self.n_docs + counts.shape[0])
+        # the corpus matrices are memory-mapped, the stacked ones are kept in memory
+        self.doc_words_matrix = sparse.vstack([self.doc_words_matrix, counts], format="csr")
+        self.tfidf_matrix = sparse.vstack([self.tfidf_matrix, tfidf_rows(counts, self.idf, TFIDF_PARAMS)], format="csr")
+        self.n_docs = self.doc_words_matrix.shape[0]
+        self.n_nonzero_counts = self.doc_words_matrix.nnz
+        self.total_term_counts = self.total_term_counts + self._total_term_counts(counts)
+        self.sum_word_counts = np.sum(self.total_term_counts)
+        self.selection.grow(self.n_docs)
+        if self.doc_topics is not None:
+            self.set_topics(self.topics_method, self.doc_topics, self.topics, self.top_words, self.word_best_topic)
+        return new_ids
+
+    @property
+    def topic_model_id(self) -> Optional[tuple]:
+        """
+        Identity of the current topics (they are determined by the corpus, the solver and the number of topics)
+        """
+        if self.topics is None:
+            return None
+        return self.fingerprint, self.topics_method, self.topics.shape[0]
+
+    @property
+    def selected_documents(self) -> List[int]:
+        return self.selection.ids().tolist()
+
+    @selected_documents.setter
+    def selected_documents(self, selected_documents):
+        self.selection.set(selected_documents)
+
+    def update_selection(self, added: np.ndarray, removed: np.ndarray):
+        """
+        Selection listener, the selection statistics are updated only by the added and removed rows
+        """
+        if removed.shape[0]:
+            self.selected_term_counts -= self._total_term_counts(self.doc_words_matrix[removed])
+        if added.shape[0]:
+            self.selected_term_counts += self._total_term_counts(self.doc_words_matrix[added])
+        if self.doc_topics is not None:
+            n_topics = self.topics.shape[0]
+            self.selected_topic_counts -= np.bincount(self.doc_topics[removed], minlength=n_topics)
+            self.selected_topic_counts += np.bincount(self.doc_topics[added], minlength=n_topics)
+
+    def topic_histogram(self) -> np.ndarray:
+        """
+        Number of selected documents of every topic, the whole corpus is used if nothing is selected
+        """
+        if not len(self.selection):
+            return np.bincount(self.doc_topics, minlength=self.topics.shape[0])
+        return self.selected_topic_counts
+
+    def _corpus_rows(self, matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+        # the rows of the corpus documents (without the added ones), the solvers are fitted on them
+        return matrix if matrix.shape[0] == self.n_corpus_docs else matrix[:self.n_corpus_docs]
 
     def _load_vocabulary(self) -> List[str]:
         vocabulary = []
@@ -101,75 +539,90 @@ class DocumentData():
         return vocabulary
     
 
-    def _load_docwords(self) -> np.ndarray:
-        with open(self.docword_path, "r") as f:
-            self.n_docs = int(f.readline().strip())
-            self.n_words = int(f.readline().strip())
-            self.n_nonzero_counts = int(f.readline().strip())
+    def _load_docwords(self) -> sparse.csr_matrix:
+        """
+        Load the UCI docword triplets directly into a sparse CSR (documents X words) count matrix
+        """
+        header, doc_ids, word_ids, counts = read_docword_file(self.docword_path)
+        self.n_docs, self.n_words, self.n_nonzero_counts = header
 
-            counts_matrix = np.zeros((self.n_docs, self.n_words))
-            for line in f:
-                split_line = line.strip().split(" ")
-                counts_matrix[int(split_line[0])-1,
-                              int(split_line[1])-1] = int(split_line[2])
+        return self._counts_to_csr(doc_ids, word_ids, counts)
 
+    def _counts_to_csr(self, doc_ids, word_ids, counts) -> sparse.csr_matrix:
+        # duplicated (doc, word) pairs are summed up by the conversion
+        counts_matrix = sparse.coo_matrix((counts, (doc_ids, word_ids)),
+                                          shape=(self.n_docs, self.n_words)).tocsr()
+        counts_matrix.sort_indices()
         return counts_matrix
     
+    @traced()
     def _pca(self):
-        #pca = PCA(n_components=2, svd_solver="arpack")
-        #return pca.fit_transform(self.tfidf_matrix)
         print("Precomputed data not found, computing PCA, please wait...")
-        matrix = self.tfidf_matrix.toarray()
-        n_components = 2
-        m, n = matrix.shape
-        eigenValues, eigenVectors = np.linalg.eig(np.cov(matrix.T))
-
-        idx = eigenValues.argsort()[::-1]
-        eigenValues = eigenValues[idx]
-        eigenVectors = eigenVectors[:, idx]
-        U = eigenVectors[:, :n_components]
+        params = DIMRED_PARAMS["pca"]
+        projection, self.pca_components, _ = randomized_pca(self._corpus_rows(self.tfidf_matrix),
+                                                            n_components=params["n_components"],
+                                                            n_oversamples=params["n_oversamples"],
+                                                            n_iter=params["n_iter"], random_state=SEED)
         print("PCA computed")
-        return (matrix @ U).astype(float)
+        return projection.astype(float)
     
+    @traced()
     def _nmf(self, n_components:int = 10):
+        from sklearn.decomposition import NMF
+
         nmf = NMF(n_components=n_components, random_state=SEED)
-        W_matrix = nmf.fit_transform(self.tfidf_matrix) # document X topics matrix
+        W_matrix = nmf.fit_transform(self._corpus_rows(self.tfidf_matrix)) # document X topics matrix
         H_matrix = nmf.components_ # topics X words matrix
 
         topics = np.argmax(W_matrix, axis=1)
 
         return topics, H_matrix
     
+    @traced()
     def _lda(self, n_components:int = 10):
+        from sklearn.decomposition import LatentDirichletAllocation
+
         lda = LatentDirichletAllocation(n_components=n_components, random_state=SEED)
-        X_new = lda.fit_transform(self.doc_words_matrix)
+        X_new = lda.fit_transform(self._corpus_rows(self.doc_words_matrix))
         topics = np.argmax(X_new, axis=1)
 
         return topics, lda.components_
 
-    def get_topics_words(self, topic_words_matrix, n:int = 100) -> List[List[str]]:
-        """
-        Get the top n words for each topic which are the most representative
-        """
-        topics_words = []
+    @traced()
+    def _fit_topics_streaming(self, solver: str, n_components: int = 10):
+        from src.streaming import MemoryTracker, fit_topics_streaming  # only the large corpora need it
 
-        for i in range(topic_words_matrix.shape[0]):
-            ind =  np.argpartition(topic_words_matrix[i, :], -n)[-n:]
+        memory = MemoryTracker()
+        doc_topics, topics = fit_topics_streaming(self._corpus_rows(self.doc_words_matrix),
+                                                  self._corpus_rows(self.tfidf_matrix), solver, n_components,
+                                                  random_state=SEED, memory=memory)
+        print(f"Topics {solver} of {self.name} fitted out-of-core, {memory.report()}")
+        return doc_topics, topics
 
-            words = [self.vocabulary[word_id] for word_id in ind]
-            topics_words.append(words)
+    def get_topics_words(self, topic_words_matrix = None, n:int = 100) -> List[List[str]]:
+        """
+        Get the top n words for each topic which are the most representative (sorted from the best)
+        """
+        if topic_words_matrix is None or topic_words_matrix is self.topics:
+            top_words = self.top_words
+        else:
+            top_words = None
+        if top_words is None or n > top_words.shape[1]:
+            top_words, _ = build_topic_index(topic_words_matrix if topic_words_matrix is not None else self.topics, n)
 
-        return topics_words
+        return [[self.vocabulary[word_id] for word_id in row] for row in top_words[:, :n].tolist()]
 
     def get_words_best_topic(self, words_idx) -> int:
-        return np.argmax(self.topics[:, words_idx])
+        return self.word_best_topic[words_idx]
 
     def _total_term_counts(self, doc_words):
-        return np.sum(doc_words, axis=0)
+        # sum in int64 so the totals of the large corpora cannot overflow
+        return np.asarray(doc_words.sum(axis=0, dtype=np.int64)).ravel()
 
     def _number_of_words_per_doc(self, doc_words):
-        return np.sum(doc_words, axis=1)
+        return np.asarray(doc_words.sum(axis=1, dtype=np.int64)).ravel()
 
+    @traced()
     def compute_g2(self, selected_documents = None):
         """
         https://dl.acm.org/doi/pdf/10.3115/1117729.1117730
@@ -178,23 +631,13 @@ class DocumentData():
         """
 
         if selected_documents is None:
-            selected_documents = self.selected_documents
-
-        unselected_documents_mask = np.ones(self.doc_words_matrix.shape[0], dtype=bool)
-        unselected_documents_mask[selected_documents] = False
-
-
-
-        term_counts_selected = self._total_term_counts(self.doc_words_matrix[selected_documents])
-        term_counts_unselected = self._total_term_counts(self.doc_words_matrix[unselected_documents_mask])
-        total_words_selected = np.sum(term_counts_selected)
-        total_words_unselected = np.sum(term_counts_unselected)
-
-        log_likelihoods = np.empty((self.doc_words_matrix.shape[1]))
-        for word in range(self.doc_words_matrix.shape[1]):
-            expected_value_selected = (self.total_term_counts[word] * total_words_selected +1)/self.sum_word_counts
-            expected_value_unselected = (self.total_term_counts[word] * total_words_unselected +1)/self.sum_word_counts
-            log_likelihoods[word] = 2* (term_counts_selected[word] * np.log((term_counts_selected[word]+1)/expected_value_selected) +
-                                term_counts_unselected[word] * np.log((term_counts_unselected[word]+1) / expected_value_unselected))
+            # the counts of the current selection are maintained incrementally
+            term_counts_selected = self.selected_term_counts
+        else:
+            # only the selected rows are summed, the unselected counts are the rest of the corpus totals
+            if isinstance(selected_documents, DocumentSelection):
+                selected_documents = selected_documents.mask  # boolean row mask
+            term_counts_selected = self._total_term_counts(self.doc_words_matrix[selected_documents])
+        term_counts_unselected = self.total_term_counts - term_counts_selected
 
-        return log_likelihoods
+        return g2_keyness(term_counts_selected, term_counts_unselected, self.total_term_counts, self.sum_word_counts)
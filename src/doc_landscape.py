@@ -1,12 +1,24 @@
 import math
 
 import numpy as np
-from PySide6.QtCore import Qt, Signal, QObject
-from PySide6.QtGui import (QColor, QPainter,
+from PySide6.QtCore import QPointF, QRectF, Qt, Signal, QObject
+from PySide6.QtGui import (QColor, QImage, QPainter, QPolygonF,
                            QPen, QTransform, QFont)
 from PySide6.QtWidgets import (QGraphicsEllipseItem,
                                QGraphicsItem, QGraphicsScene, QGraphicsView,
-                               QGraphicsTextItem)
+                               QGraphicsTextItem, QStyleOptionGraphicsItem)
+
+from src.selection import DocumentSelection
+from src.spatial_index import DensityPyramid, GridIndex
+from src.tracing import span, traced
+
+DOC_DIAMETER = 3  # diameter of the document ellipses
+DOC_PEN_WIDTH = 0.5
+# level of detail: when zoomed out (fewer screen pixels per scene unit than the threshold) and the view contains
+# more documents than the limit, density tiles of at least DENSITY_TILE_PIXELS are drawn instead of the documents
+LOD_ZOOM_THRESHOLD = 2.0
+MAX_VISIBLE_DOCUMENTS = 5000
+DENSITY_TILE_PIXELS = 4
 
 
 class Compass(QGraphicsEllipseItem, QObject):
@@ -24,73 +36,215 @@ class Compass(QGraphicsEllipseItem, QObject):
         return super().itemChange(change, value)
 
 
-class DocumentEllipse(QGraphicsEllipseItem):
-    def __init__(self, x, y, w, h, brush, id: str) -> None:
-        super(DocumentEllipse, self).__init__(x, y, w, h)
-        self.pen_unselected = QPen(Qt.black, 0.5)
-        self.pen_selected = QPen(Qt.red, 0.5)
-        self.setPen(self.pen_unselected)
-        self.setBrush(brush)
-        self.id = id
-        self.selected = False
-
-        # Enable hover events
+class DocumentCloud(QGraphicsItem):
+    """
+    One item drawing all the documents from the coordinate and topic arrays in a single paint pass.
+    Labels are created only for the hovered and selected documents.
+    Zoomed out views of many documents are drawn as topic coloured density tiles (see LOD_ZOOM_THRESHOLD).
+    """
+    def __init__(self, x: np.ndarray, y: np.ndarray, doc_topic: np.ndarray, brush, spatial_index: GridIndex) -> None:
+        super(DocumentCloud, self).__init__()
+        # x, y are the top left corners of the documents (as of the ellipses before)
+        self.x = x
+        self.y = y
+        self.doc_topic = doc_topic
+        self.brush = brush
+        self.spatial_index = spatial_index
+        self.selected = np.zeros(x.shape[0], dtype=bool)
+        self.hovered = None
+        self.labels = {}  # document id -> label
+
+        # round points of the pen width draw the ellipse, first the outline then the fill
+        self.pen_unselected = QPen(Qt.black, DOC_DIAMETER + DOC_PEN_WIDTH, Qt.SolidLine, Qt.RoundCap)
+        self.pen_selected = QPen(Qt.red, DOC_DIAMETER + DOC_PEN_WIDTH, Qt.SolidLine, Qt.RoundCap)
+        self.pens_fill = [QPen(b.color(), DOC_DIAMETER - DOC_PEN_WIDTH, Qt.SolidLine, Qt.RoundCap) for b in brush]
+        self.topic_points = self._points_by_topic(np.arange(x.shape[0]))
+        # the selected points of every topic, a selection delta splices them (see update_selection)
+        self.selected_points = {}  # topic -> polygon of the selected document centres
+        self.selected_ids = {}  # topic -> ids of the documents in the order of their polygon points
+        self.selected_slots = np.full(x.shape[0], -1, dtype=np.int64)  # point index in the topic polygon
+        self.n_selected = 0
+        self.topic_colors = np.array([b.color().getRgb()[:3] for b in brush], dtype=np.uint8)
+        self._update_extent()
         self.setAcceptHoverEvents(True)
 
-        self.label_clicked = False
-        self.compass_over = False
-
-        self.label = QGraphicsTextItem(id, self)
-        font = QFont()
-        font.setPointSize(3)  # Set the font size
-        self.label.setFont(font)
-
-        self.label.setDefaultTextColor(Qt.black)
-        self.label.setVisible(False)
-
-        label_height = self.label.boundingRect().height()
-        label_x = self.rect().right()
-        label_y = self.rect().top()
-        self.label.setPos(label_x, label_y - label_height / 2)
-
-    def mousePressEvent(self, event):
-        self.label_clicked = not self.label_clicked
-        if not self.selected:
-            self.selectionHandler()
+    def _update_extent(self) -> None:
+        # density tiles for the zoomed out views, the tile images are built lazily per level
+        centre = DOC_DIAMETER / 2
+        self.density = DensityPyramid(np.column_stack([self.x + centre, self.y + centre]), self.doc_topic,
+                                      len(self.brush))
+        self.density_images = {}
+
+        margin = DOC_DIAMETER + DOC_PEN_WIDTH
+        if self.x.shape[0]:
+            self.rect = QRectF(QPointF(np.min(self.x) - margin, np.min(self.y) - margin),
+                               QPointF(np.max(self.x) + 2 * margin, np.max(self.y) + 2 * margin))
         else:
-            self.unselectionHandler()
-
-        super().mousePressEvent(event)
-
-    def hoverEnterEvent(self, event):
-        self.label.setVisible(True)
-        super().hoverEnterEvent(event)
+            self.rect = QRectF()
+
+    def append(self, x: np.ndarray, y: np.ndarray, doc_topic: np.ndarray, spatial_index: GridIndex) -> None:
+        """
+        Add documents, only the points of the new ones are built (the density tiles are recounted)
+        """
+        ids = np.arange(self.x.shape[0], self.x.shape[0] + x.shape[0])
+        self.x = np.concatenate([self.x, x])
+        self.y = np.concatenate([self.y, y])
+        self.doc_topic = np.concatenate([self.doc_topic, doc_topic])
+        self.selected = np.concatenate([self.selected, np.zeros(x.shape[0], dtype=bool)])
+        self.selected_slots = np.concatenate([self.selected_slots, np.full(x.shape[0], -1, dtype=np.int64)])
+        self.spatial_index = spatial_index
+        self.topic_points += self._points_by_topic(ids)
+        self.prepareGeometryChange()
+        self._update_extent()
+        self.update()
+
+    def _points_by_topic(self, ids: np.ndarray):
+        # (topic, polygon of the document centres) for every topic present among ids
+        centre = DOC_DIAMETER / 2
+        topics = self.doc_topic[ids]
+        points = []
+        for topic in np.unique(topics):
+            topic_ids = ids[topics == topic]
+            polygon = QPolygonF([QPointF(px + centre, py + centre)
+                                 for px, py in zip(self.x[topic_ids].tolist(), self.y[topic_ids].tolist())])
+            points.append((int(topic), polygon))
+        return points
+
+    def boundingRect(self) -> QRectF:
+        return self.rect
+
+    def paint(self, painter: QPainter, option, widget=None) -> None:
+        # the zoom of the view (set by its wheelEvent) and the documents it shows decide the level of detail.
+        # The whole painted viewport is counted, not the exposed region, so a partial repaint (hover, selection)
+        # takes the same decision as the full one and never draws points over the density tiles
+        transform = painter.worldTransform()
+        pixels_per_unit = QStyleOptionGraphicsItem.levelOfDetailFromTransform(transform)
+        visible = transform.inverted()[0].mapRect(QRectF(painter.viewport()))
+        if pixels_per_unit < LOD_ZOOM_THRESHOLD and self.density.count_rect(
+                visible.left(), visible.top(), visible.right(), visible.bottom()) > MAX_VISIBLE_DOCUMENTS:
+            self._paint_density(painter, self.density.level_for(pixels_per_unit, DENSITY_TILE_PIXELS))
+            layers = ((self.pen_selected, self.selected_points.items()),)
+        else:
+            layers = ((self.pen_unselected, self.topic_points), (self.pen_selected, self.selected_points.items()))
+
+        for pen_outline, topic_points in layers:
+            for topic, polygon in topic_points:
+                painter.setPen(pen_outline)
+                painter.drawPoints(polygon)
+                painter.setPen(self.pens_fill[topic])
+                painter.drawPoints(polygon)
+
+    def _paint_density(self, painter: QPainter, level: int) -> None:
+        image = self.density_images.get(level)
+        if image is None:
+            rgba = np.ascontiguousarray(self.density.rgba(level, self.topic_colors))
+            image = QImage(rgba.data, rgba.shape[1], rgba.shape[0], rgba.strides[0], QImage.Format_RGBA8888).copy()
+            self.density_images[level] = image
+        cell_size = self.density.cell_sizes[level]
+        target = QRectF(self.density.origin[0], self.density.origin[1],
+                        image.width() * cell_size, image.height() * cell_size)
+        painter.save()
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, False)  # sharp tiles
+        painter.drawImage(target, image)
+        painter.restore()
+
+    def doc_at(self, pos: QPointF):
+        """
+        Id of the document under the (item) position or None
+        """
+        centre = DOC_DIAMETER / 2
+        return self.spatial_index.nearest(pos.x() - centre, pos.y() - centre, centre + DOC_PEN_WIDTH / 2)
+
+    def update_selection(self, added, removed) -> None:
+        """
+        Apply a selection delta in O(delta): the points of the removed documents are swapped with the last point
+        of their topic polygon and dropped, the added ones are appended. A delta larger than the resulting
+        selection rebuilds the polygons at once instead.
+        """
+        added = np.asarray(added, dtype=np.int64)
+        removed = np.asarray(removed, dtype=np.int64)
+        if not added.shape[0] and not removed.shape[0]:
+            return
+        self.selected[removed] = False
+        self.selected[added] = True
+        self.n_selected += added.shape[0] - removed.shape[0]
+        if added.shape[0] + removed.shape[0] > self.n_selected:
+            self._rebuild_selected_points()
+        else:
+            for doc_id in removed.tolist():
+                self._remove_selected_point(doc_id)
+            for doc_id in added.tolist():
+                self._add_selected_point(doc_id)
+        for doc_id in np.concatenate([removed, added]).tolist():
+            self._update_label(doc_id)
+        self.update()
+
+    def _rebuild_selected_points(self) -> None:
+        ids = np.flatnonzero(self.selected)
+        self.selected_slots[:] = -1
+        self.selected_points = dict(self._points_by_topic(ids))
+        topics = self.doc_topic[ids]
+        self.selected_ids = {}
+        for topic in self.selected_points:
+            topic_ids = ids[topics == topic]
+            self.selected_ids[topic] = topic_ids.tolist()
+            self.selected_slots[topic_ids] = np.arange(topic_ids.shape[0])
+
+    def _add_selected_point(self, doc_id: int) -> None:
+        topic = int(self.doc_topic[doc_id])
+        if topic not in self.selected_points:
+            self.selected_points[topic] = QPolygonF()
+            self.selected_ids[topic] = []
+        centre = DOC_DIAMETER / 2
+        self.selected_points[topic].append(QPointF(float(self.x[doc_id]) + centre, float(self.y[doc_id]) + centre))
+        self.selected_slots[doc_id] = len(self.selected_ids[topic])
+        self.selected_ids[topic].append(doc_id)
+
+    def _remove_selected_point(self, doc_id: int) -> None:
+        topic = int(self.doc_topic[doc_id])
+        polygon, topic_ids = self.selected_points[topic], self.selected_ids[topic]
+        slot, last = int(self.selected_slots[doc_id]), len(topic_ids) - 1
+        if slot != last:
+            polygon.swapItemsAt(slot, last)
+            topic_ids[slot] = topic_ids[last]
+            self.selected_slots[topic_ids[slot]] = slot
+        polygon.removeLast()
+        topic_ids.pop()
+        self.selected_slots[doc_id] = -1
+
+    def _update_label(self, doc_id: int) -> None:
+        visible = self.selected[doc_id] or doc_id == self.hovered
+        label = self.labels.get(doc_id)
+        if visible and label is None:
+            label = QGraphicsTextItem(str(doc_id), self)
+            font = QFont()
+            font.setPointSize(3)  # Set the font size
+            label.setFont(font)
+            label.setDefaultTextColor(Qt.black)
+            label.setPos(self.x[doc_id] + DOC_DIAMETER, self.y[doc_id] - label.boundingRect().height() / 2)
+            self.labels[doc_id] = label
+        elif not visible and label is not None:
+            label.setParentItem(None)
+            if label.scene() is not None:
+                label.scene().removeItem(label)
+            del self.labels[doc_id]
+
+    def hoverMoveEvent(self, event):
+        doc_id = self.doc_at(event.pos())
+        if doc_id != self.hovered:
+            previous, self.hovered = self.hovered, doc_id
+            if previous is not None:
+                self._update_label(previous)
+            if doc_id is not None:
+                self._update_label(doc_id)
+        super().hoverMoveEvent(event)
 
     def hoverLeaveEvent(self, event):
-        if not self.selected:
-            self.label.setVisible(False)
+        previous, self.hovered = self.hovered, None
+        if previous is not None:
+            self._update_label(previous)
         super().hoverLeaveEvent(event)
 
-    def compassOver(self):
-        self.compass_over = True
-        self.selectionHandler()
-
-    def compassNotOver(self):
-        self.compass_over = False
-        self.unselectionHandler()
-
-    def selectionHandler(self):
-        self.selected = True
-        self.setSelected(True)
-        self.setPen(self.pen_selected)
-        self.label.setVisible(True)
-
-    def unselectionHandler(self):
-        self.selected = False
-        self.setSelected(False)
-        self.setPen(self.pen_unselected)
-        self.label.setVisible(False)
-
 
 class VisGraphicsScene(QGraphicsScene):
     # define signal for selection change
@@ -103,38 +257,54 @@ class VisGraphicsScene(QGraphicsScene):
         self.wasDragg = False
         self.pen_compass = QPen(Qt.black, 2)
         self.compass = None
-        self.selected_docs = []  # store selected documents
-        self.elipse2id = {}  # store mapping from elipse to document id
+        self.selection = None  # selected documents, shared with the table and the data
+        self.cloud = None  # item drawing all the documents
         self.ctrl_pressed = False
-
+        # mapping of the embedding to the screen of the current plot, (x, y) offsets and scales
+        self.coords_offset = None
+        self.coords_scale = None
+
+    def set_selection(self, selection: DocumentSelection) -> None:
+        """
+        Use the selection of newly loaded data, the documents are redrawn on its deltas
+        """
+        if self.selection is not None:
+            self.selection.unsubscribe(self.on_selection_delta)
+        self.selection = selection
+        self.selection.subscribe(self.on_selection_delta)
+
+    def on_selection_delta(self, added: np.ndarray, removed: np.ndarray) -> None:
+        if self.cloud is not None:
+            self.cloud.update_selection(added, removed)
+
+    def clear(self) -> None:
+        self.cloud = None
+        self.compass = None
+        super().clear()
 
     def mouseReleaseEvent(self, event):
         if (self.wasDragg):
             return
         # check what was clicked
         item = self.itemAt(event.scenePos(), QTransform())
-        self.handle_item_click(item)
-
-    def handle_item_click(self, item):
         if item is self.compass:
             pass
             # print("Compass clicked")
-        elif isinstance(item, DocumentEllipse):
-            if self.elipse2id.get(item) in self.selected_docs:
-                self.selected_docs.remove(self.elipse2id.get(item))
-                item.unselectionHandler()
-                self.selectionChanged.emit()
-            else:
-                if not self.global_event.ctrl_pressed:
-                    for elipseid in self.selected_docs:
-                        self.doc_elipses[elipseid].unselectionHandler()
-                    self.selected_docs = [self.elipse2id.get(item)]
-                else:
-                    self.selected_docs.append(self.elipse2id.get(item))
-                item.selectionHandler()
-                self.selectionChanged.emit()
-
+        elif item is not None and item is self.cloud:
+            doc_id = self.cloud.doc_at(event.scenePos())
+            if doc_id is not None:
+                self.handle_doc_click(doc_id)
+
+    def handle_doc_click(self, doc_id: int):
+        if doc_id in self.selection:
+            self.selection.remove([doc_id])
+        elif not self.global_event.ctrl_pressed:
+            self.selection.set([doc_id])
+        else:
+            self.selection.add([doc_id])
+        self.selectionChanged.emit()
 
+    @traced()
     def generateAndMapData(self, document_coords, doc_topic, brush):
         # remap the results to the screen
         x = document_coords[:, 0]
@@ -153,43 +323,53 @@ class VisGraphicsScene(QGraphicsScene):
         x = x_min_max_scaled * width
         y = y_min_max_scaled * height
         c = doc_topic  # get colors
+        self.coords_offset = np.array([x_min, y_min])
+        self.coords_scale = np.array([width / (x_max - x_min), height / (y_max - y_min)])
+
+        # spatial index of the documents (their top left corners) for the hit-testing
+        with span("spatial index"):
+            self.spatial_index = GridIndex(np.column_stack([x, y]), cell_size=16)
 
-        # Map data to graphical elements
-        self.doc_elipses = []
-        for i in range(0, x.shape[0]):
-            d = 3
-            ellipse = DocumentEllipse(x[i], y[i], d, d, brush[c[i]], str(i))
-            # ellipse = self.addEllipse(x[i], y[i], d,d, self.pen_docs, brush[c[i]])
-            self.addItem(ellipse)
-            self.elipse2id[ellipse] = i
-            self.doc_elipses.append(ellipse)
+        # a new plot starts with nothing selected
+        with span("clear selection"):
+            self.selection.clear()
+
+        # Map data to one graphical element drawing all the documents
+        with span("document cloud"):
+            self.cloud = DocumentCloud(x, y, c, brush, self.spatial_index)
+            self.addItem(self.cloud)
 
         self.init_compass(width, height)
-        self.selected_docs = []
-        self.selectionChanged.emit()
+        with span("selectionChanged"):
+            self.selectionChanged.emit()
 
+    @traced()
+    def add_documents(self, document_coords, doc_topic):
+        """
+        Draw documents added to the plotted data, mapped to the screen as the plotted ones, the plot and the
+        selection are kept
+        """
+        points = (np.asarray(document_coords) - self.coords_offset) * self.coords_scale
+        self.spatial_index = GridIndex(np.vstack([self.spatial_index.points, points]), cell_size=16)
+        self.cloud.append(points[:, 0], points[:, 1], doc_topic, self.spatial_index)
+
+    @traced()
     def get_ellipses_ids_inside_compass(self):
         # print("Compass moved", self.compass.scenePos())
-        ellipses_inside_area = []
+        # the ellipse (with its pen) has to lie inside the compass bounding rect (with its pen)
         target_rect = self.compass.sceneBoundingRect()
-
-        for item in self.items():
-            if isinstance(item, QGraphicsEllipseItem) and item != self.compass:
-                item_rect = item.sceneBoundingRect()
-                if target_rect.contains(item_rect):
-                    item.compassOver()
-                    ellipses_inside_area.append(self.elipse2id[item])
-                elif not self.global_event.ctrl_pressed:
-                    item.compassNotOver()
-
-        if ellipses_inside_area != self.selected_docs:
-            if not self.global_event.ctrl_pressed:
-                self.selected_docs = ellipses_inside_area
-            else:
-                for item in ellipses_inside_area:
-                    if item not in self.selected_docs:
-                        self.selected_docs.append(item)
-                        self.doc_elipses[item].selectionHandler()
+        margin = DOC_PEN_WIDTH / 2
+        ellipses_inside_area = self.spatial_index.query_rect(target_rect.left() + margin,
+                                                             target_rect.top() + margin,
+                                                             target_rect.right() - DOC_DIAMETER - margin,
+                                                             target_rect.bottom() - DOC_DIAMETER - margin)
+
+        # only the ellipses whose membership changes are touched (by the selection listeners)
+        if not self.global_event.ctrl_pressed:
+            changed = self.selection.set(ellipses_inside_area)
+        else:
+            changed = self.selection.add(ellipses_inside_area)
+        if changed:
             self.selectionChanged.emit()
 
 
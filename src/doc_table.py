@@ -1,17 +1,92 @@
-from PySide6.QtCore import Qt
-from PySide6.QtWidgets import (QPushButton, QSizePolicy, QTableWidget,
-                               QVBoxLayout, QWidget)
+import numpy as np
+from PySide6.QtCore import QAbstractTableModel, QModelIndex, Qt
+from PySide6.QtGui import QGuiApplication
+from PySide6.QtWidgets import (QAbstractItemView, QHeaderView, QPushButton,
+                               QSizePolicy, QTableView, QVBoxLayout, QWidget)
 
+from src.selection import DocumentSelection
+from src.tracing import traced
 from src.wordcloud import WordCloudWindow
 
 
+class DocumentTableModel(QAbstractTableModel):
+    """
+    Table of the documents and their topics backed directly by the doc_topics array.
+    The selected documents come first (sorted), which is only a permutation of the rows, the cells are
+    materialised by the view for the visible rows only.
+    """
+    HEADERS = ["Doc ID", "Topic ID", "Topic Colour"]
+
+    def __init__(self, parent=None) -> None:
+        super(DocumentTableModel, self).__init__(parent)
+        self.doc_topics = None
+        self.brush = []
+        self.order = np.zeros(0, dtype=np.int64)  # row -> document id
+        self.n_selected = 0
+
+    @traced()
+    def set_documents(self, doc_topics, brush) -> None:
+        self.beginResetModel()
+        self.doc_topics = doc_topics
+        self.brush = brush
+        n_docs = doc_topics.shape[0] if doc_topics is not None else 0
+        self.order = np.arange(n_docs)
+        self.n_selected = 0
+        self.endResetModel()
+
+    @traced()
+    def set_selection(self, selection: DocumentSelection) -> None:
+        """
+        Move the selected documents to the top, the rest keeps the document order
+        """
+        self.layoutAboutToBeChanged.emit()
+        self.order = np.concatenate([np.flatnonzero(selection.mask), np.flatnonzero(~selection.mask)])
+        self.n_selected = len(selection)
+        self.layoutChanged.emit()
+
+    def doc_id(self, row: int) -> int:
+        return int(self.order[row])
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else self.order.shape[0]
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        doc_id = self.order[index.row()]
+        topic = int(self.doc_topics[doc_id])
+        column = index.column()
+        if role == Qt.DisplayRole and column < 2:
+            return str(doc_id) if column == 0 else str(topic)
+        if role == Qt.BackgroundRole:
+            if column == 2:
+                return self.brush[topic]
+            if index.row() < self.n_selected:  # highlight the selected rows
+                return QGuiApplication.palette().highlight()
+        if role == Qt.ForegroundRole and column < 2 and index.row() < self.n_selected:
+            return QGuiApplication.palette().highlightedText()
+        return None
+
+
 class TableView(QWidget):
     def __init__(self):
         super(TableView, self).__init__()
 
         #table init
-        self.table = QTableWidget()
-        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.model = DocumentTableModel()
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.verticalHeader().setVisible(False)
 
         #button init
         self.button1 = QPushButton("Generate Wordcloud")
@@ -38,11 +113,26 @@ class TableView(QWidget):
         self.setLayout(self.main_layout)
 
         self.document_data = None
+        self.new_window = None  # the wordcloud window is reused
 
 
     def open_selection_wordcloud(self):
-        self.new_window = WordCloudWindow(self.document_data)
+        if self.new_window is None:
+            self.new_window = WordCloudWindow(self.document_data)
+        elif self.new_window.document_data is not self.document_data:
+            self.new_window.set_document_data(self.document_data)
+        else:
+            self.new_window.refresh()
         self.new_window.show()
+        self.new_window.raise_()
+
+    def on_selection_changed(self):
+        # an open wordcloud follows the selection
+        if self.new_window is not None and self.new_window.isVisible():
+            if self.new_window.document_data is not self.document_data:
+                self.new_window.set_document_data(self.document_data)
+            else:
+                self.new_window.schedule_refresh()
 
     # def open_topic_wordcloud(self):
     #     self.new_window = WordCloudWindow(self.document_data, use_topic=True)
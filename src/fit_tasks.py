@@ -0,0 +1,23 @@
+"""
+Functions executed in the worker processes. They must not import PySide6, every worker reopens the
+(memory-mapped) compiled corpus and stores its result into the shared result cache.
+n_threads limits the BLAS/OpenMP threads of the worker (None means no limit).
+"""
+from typing import Optional
+
+from threadpoolctl import threadpool_limits
+
+from src.data_utils import DocumentData
+
+
+def fit_embedding_task(data_path: str, name: str, solver: str, n_threads: Optional[int] = None):
+    with threadpool_limits(limits=n_threads):
+        document = DocumentData(data_path=data_path, name=name)
+        return document.fit_transform(solver)
+
+
+def fit_topics_task(data_path: str, name: str, solver: str, n_components: int, n_threads: Optional[int] = None):
+    with threadpool_limits(limits=n_threads):
+        document = DocumentData(data_path=data_path, name=name)
+        document.fit_topics(solver, n_components=n_components)
+        return document.doc_topics, document.topics, document.top_words, document.word_best_topic
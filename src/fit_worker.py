@@ -0,0 +1,158 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, Hashable, Optional
+
+from PySide6.QtCore import QObject, QTimer, Signal
+
+from src.worker_pool import WorkerPool
+
+# CPU budget of the speculative precomputation: number of worker processes and BLAS threads of each of them
+SPECULATIVE_WORKERS = 1
+SPECULATIVE_THREADS = 1
+
+
+class FitScheduler(QObject):
+    """
+    Runs the expensive fits (t-SNE, UMAP, NMF, LDA) in a process pool so the GUI never blocks.
+    Every request goes to a named slot ("dimred", "topics"), a newer request for the same slot cancels the
+    older one, the worker process running the cancelled job is terminated (and replaced for the next jobs).
+
+    Besides that, speculative jobs (results the user will probably ask for next) run in extra idle workers, they
+    only fill the result cache. They are started only while no requested job is running and never use more than
+    speculative_workers processes, so the requested jobs always have a free worker.
+    """
+    # slot name, result
+    finished = Signal(str, object)
+    # slot name, error message
+    failed = Signal(str, str)
+    # human readable description of the running jobs
+    progress = Signal(str)
+    # internal, moves the future callbacks (called in the reader threads of the pool) to the GUI thread
+    _futureDone = Signal(str, int, object)
+    _speculationDone = Signal(object)
+
+    def __init__(self, max_workers: Optional[int] = None, speculative_workers: int = SPECULATIVE_WORKERS,
+                 speculative_threads: int = SPECULATIVE_THREADS, parent=None) -> None:
+        super(FitScheduler, self).__init__(parent)
+        # the fits are multi-threaded themselves, a couple of workers is enough and leaves a core for the GUI
+        self.max_workers = max_workers or max(1, min(2, (os.cpu_count() or 1) - 1))
+        self.speculative_workers = speculative_workers
+        self.speculative_threads = speculative_threads
+        self.pool = WorkerPool(self.max_workers + self.speculative_workers)
+        self.generations: Dict[str, int] = {}
+        self.futures: Dict[str, Future] = {}
+        self.keys: Dict[str, Hashable] = {}
+        # queued (key, description, function, args) and running speculative jobs
+        self.speculative_queue = deque()
+        self.speculative_futures: Dict[Hashable, Future] = {}
+        self.descriptions: Dict[str, str] = {}
+        self.start_times: Dict[str, float] = {}
+        self._futureDone.connect(self._on_future_done)
+        self._speculationDone.connect(self._on_speculation_done)
+
+        self.progress_timer = QTimer(self)
+        self.progress_timer.setInterval(1000)
+        self.progress_timer.timeout.connect(self._report_progress)
+
+    def submit(self, slot: str, description: str, function, *args, key: Optional[Hashable] = None) -> None:
+        """
+        Run function(*args) in a worker process, finished(slot, result) is emitted when it is done.
+        If a speculative job with the same key is already running, its result is used instead.
+        """
+        self.cancel(slot)
+        generation = self.generations[slot]
+        self.speculative_queue = deque(job for job in self.speculative_queue if job[0] != key)
+        future = self.speculative_futures.get(key) if key is not None else None
+        if future is None:
+            future = self.pool.submit(function, *args)
+        self.futures[slot] = future
+        self.keys[slot] = key
+        self.descriptions[slot] = description
+        self.start_times[slot] = time.perf_counter()
+        future.add_done_callback(lambda f: self._futureDone.emit(slot, generation, f))
+        self._report_progress()
+        self.progress_timer.start()
+
+    def cancel(self, slot: str) -> None:
+        """
+        Forget the current request of the slot, its result will not be delivered and its worker is terminated
+        (unless it is a speculative job, that one is left to fill the result cache)
+        """
+        self.generations[slot] = self.generations.get(slot, 0) + 1
+        future = self.futures.pop(slot, None)
+        if future is not None and self.keys.get(slot) not in self.speculative_futures:
+            # the result cache is written atomically, a terminated job leaves no partial entry behind
+            self.pool.cancel(future)
+        self.keys.pop(slot, None)
+        self.descriptions.pop(slot, None)
+        self.start_times.pop(slot, None)
+        if not self.futures:
+            self.progress_timer.stop()
+
+    def is_running(self, slot: str) -> bool:
+        return slot in self.futures
+
+    def _on_future_done(self, slot: str, generation: int, future: Future) -> None:
+        if generation != self.generations.get(slot) or future.cancelled():
+            return  # stale result, a newer request for the slot was made
+        description = self.descriptions.pop(slot, slot)
+        elapsed = time.perf_counter() - self.start_times.pop(slot, time.perf_counter())
+        del self.futures[slot]
+        self.keys.pop(slot, None)
+        if not self.futures:
+            self.progress_timer.stop()
+        self._dispatch_speculation()
+
+        exception = future.exception()
+        if exception is not None:
+            self.failed.emit(slot, f"Computing {description} failed: {exception}")
+            return
+        self.progress.emit(f"Computed {description} in {elapsed:.1f} s")
+        self.finished.emit(slot, future.result())
+
+    def speculate(self, key: Hashable, description: str, function, *args) -> None:
+        """
+        Queue a job whose result is only stored in the result cache by the worker
+        """
+        if key in self.speculative_futures or any(job[0] == key for job in self.speculative_queue):
+            return
+        if any(slot_key == key for slot_key in self.keys.values()):
+            return
+        self.speculative_queue.append((key, description, function, args))
+        self._dispatch_speculation()
+
+    def clear_speculation(self) -> None:
+        """
+        Drop the queued speculative jobs, the running ones are left to finish (their results land in the cache)
+        """
+        self.speculative_queue.clear()
+
+    def _dispatch_speculation(self) -> None:
+        # speculative jobs only run while the requested jobs are idle
+        while self.speculative_queue and not self.futures \
+                and len(self.speculative_futures) < self.speculative_workers:
+            key, description, function, args = self.speculative_queue.popleft()
+            future = self.pool.submit(function, *args, n_threads=self.speculative_threads)
+            self.speculative_futures[key] = future
+            future.add_done_callback(lambda f, key=key: self._speculationDone.emit(key))
+
+    def _on_speculation_done(self, key: Hashable) -> None:
+        self.speculative_futures.pop(key, None)
+        self._dispatch_speculation()
+
+    def _report_progress(self) -> None:
+        if not self.futures:
+            return
+        now = time.perf_counter()
+        running = ", ".join(f"{self.descriptions[slot]} ({now - self.start_times[slot]:.0f} s)"
+                            for slot in self.futures)
+        self.progress.emit(f"Computing in background: {running}")
+
+    def shutdown(self) -> None:
+        self.clear_speculation()
+        for slot in list(self.futures):
+            self.cancel(slot)
+        # the running speculative jobs too, nothing may keep the application from exiting
+        self.pool.shutdown()
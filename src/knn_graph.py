@@ -0,0 +1,103 @@
+"""
+k-nearest-neighbour graph of the documents shared by the t-SNE and UMAP embeddings.
+The graph is built once per corpus directly on the sparse TF-IDF and cached, both embeddings are then fitted from it
+instead of searching the neighbours themselves. Up to EXACT_KNN_MAX_DOCS documents the neighbours are searched
+exactly by chunked sparse products, the larger corpora use the approximate pynndescent.
+(A low dimensional SVD of the TF-IDF would be faster to search, but it keeps only a small part of the true
+neighbours of the documents.)
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+EXACT_KNN_MAX_DOCS = 20000  # the exact search is quadratic in the number of documents
+KNN_CHUNK_DOCS = 1024  # query documents compared to all the documents at once
+
+
+def exact_neighbors(data, queries, n_neighbors: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exact euclidean nearest rows of data for every row of queries (both sparse or dense).
+    Returns the (queries X n_neighbors) indices and distances, sorted from the nearest.
+    """
+    n_neighbors = min(n_neighbors, data.shape[0])
+    data_norms = _squared_norms(data)
+    indices = np.empty((queries.shape[0], n_neighbors), dtype=np.int64)
+    distances = np.empty((queries.shape[0], n_neighbors))
+    for start in range(0, queries.shape[0], KNN_CHUNK_DOCS):
+        chunk = queries[start:start + KNN_CHUNK_DOCS]
+        products = chunk @ data.T
+        products = products.toarray() if sparse.issparse(products) else np.asarray(products)
+        # |a - b|^2 = |a|^2 + |b|^2 - 2 a.b
+        squared = np.maximum(_squared_norms(chunk)[:, np.newaxis] + data_norms[np.newaxis, :] - 2 * products, 0)
+        nearest = np.argpartition(squared, n_neighbors - 1, axis=1)[:, :n_neighbors]
+        nearest_squared = np.take_along_axis(squared, nearest, axis=1)
+        order = np.argsort(nearest_squared, axis=1, kind="stable")
+        stop = start + nearest.shape[0]
+        indices[start:stop] = np.take_along_axis(nearest, order, axis=1)
+        distances[start:stop] = np.sqrt(np.take_along_axis(nearest_squared, order, axis=1))
+    return indices, distances
+
+
+def _squared_norms(matrix) -> np.ndarray:
+    if sparse.issparse(matrix):
+        return np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel()
+    return np.einsum("ij,ij->i", matrix, matrix)
+
+
+def build_knn_graph(data, n_neighbors: int, metric: str = "euclidean",
+                    random_state: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Indices and distances of the n_neighbors nearest neighbours of every document (sorted from the nearest,
+    the document itself is not included)
+    """
+    n_samples = data.shape[0]
+    n_neighbors = min(n_neighbors, n_samples - 1)
+    if metric == "euclidean" and n_samples <= EXACT_KNN_MAX_DOCS:
+        indices, distances = exact_neighbors(data, data, n_neighbors + 1)
+    else:
+        from pynndescent import NNDescent  # numba compiled, imported only when a graph is built
+
+        index = NNDescent(data, n_neighbors=n_neighbors + 1, metric=metric, random_state=random_state,
+                          low_memory=True, compressed=True)
+        indices, distances = index.neighbor_graph
+    # drop the document itself, it is usually but not always the first neighbour
+    not_self = indices != np.arange(n_samples)[:, np.newaxis]
+    order = np.argsort(~not_self, axis=1, kind="stable")[:, :n_neighbors]
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(distances, order, axis=1)
+
+
+def tsne_from_knn(indices: np.ndarray, distances: np.ndarray, perplexity: float = 30.0,
+                  random_state: Optional[int] = None, **params) -> np.ndarray:
+    """
+    Barnes-Hut t-SNE of the precomputed neighbours, it needs at least 3 * perplexity + 1 of them
+    """
+    n_samples, n_neighbors = indices.shape
+    # t-SNE works with the squared euclidean distances, every document is stored as its own (zero distance)
+    # neighbour as sklearn leaves the documents themselves out of the precomputed neighbours
+    graph_indices = np.column_stack([np.arange(n_samples), indices])
+    graph_distances = np.column_stack([np.zeros(n_samples), distances.astype(np.float64) ** 2])
+    graph = sparse.csr_matrix((graph_distances.ravel(), graph_indices.ravel(),
+                               np.arange(0, n_samples * (n_neighbors + 1) + 1, n_neighbors + 1)),
+                              shape=(n_samples, n_samples))
+    from sklearn.manifold import TSNE
+
+    tsne = TSNE(metric="precomputed", perplexity=min(perplexity, (n_neighbors - 1) / 3),
+                random_state=random_state, **params)
+    return tsne.fit_transform(graph)
+
+
+def umap_from_knn(data, indices: np.ndarray, distances: np.ndarray, n_neighbors: int = 15,
+                  **params) -> np.ndarray:
+    """
+    UMAP of the n_neighbors nearest of the precomputed neighbours
+    """
+    n_samples = indices.shape[0]
+    n_neighbors = min(n_neighbors, indices.shape[1] + 1)
+    # UMAP expects every document to be its own first neighbour
+    knn_indices = np.column_stack([np.arange(n_samples), indices[:, :n_neighbors - 1]])
+    knn_distances = np.column_stack([np.zeros(n_samples, dtype=distances.dtype), distances[:, :n_neighbors - 1]])
+    from umap import UMAP  # numba compiled, imported only when an embedding is fitted
+
+    umap = UMAP(n_neighbors=n_neighbors, precomputed_knn=(knn_indices, knn_distances, None), **params)
+    return umap.fit_transform(data)
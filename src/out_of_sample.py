@@ -0,0 +1,82 @@
+"""
+Placing documents added to an already fitted corpus without refitting anything.
+The fitted solvers are not kept (they run in the worker processes, only their results are cached), so the new
+documents are projected from the cached results: onto the PCA axes, by interpolating the t-SNE/UMAP coordinates of
+their nearest corpus documents and by folding them into the fixed NMF/LDA topics.
+"""
+import numpy as np
+from scipy import sparse
+
+from src.knn_graph import exact_neighbors
+
+OUT_OF_SAMPLE_NEIGHBORS = 10  # corpus documents the coordinates of a new document are interpolated from
+
+
+def tfidf_rows(counts: sparse.csr_matrix, idf: np.ndarray, params: dict) -> sparse.csr_matrix:
+    """
+    TF-IDF of documents with the idf of the corpus, as TfidfTransformer(**params).transform
+    (norm, use_idf and sublinear_tf are applied, the idf is given)
+    """
+    from sklearn.preprocessing import normalize
+
+    tfidf = sparse.csr_matrix(counts, dtype=np.float64, copy=True)
+    if params.get("sublinear_tf", False):
+        np.log(tfidf.data, out=tfidf.data)
+        tfidf.data += 1
+    if params.get("use_idf", True):
+        tfidf.data *= np.asarray(idf, dtype=np.float64)[tfidf.indices]  # keeps the sparsity structure
+    norm = params.get("norm", "l2")
+    if norm is not None:
+        tfidf = normalize(tfidf, norm=norm, copy=False)
+    return tfidf.tocsr()
+
+
+def interpolate_embedding(embedding: np.ndarray, corpus_tfidf: sparse.csr_matrix, tfidf: sparse.csr_matrix,
+                          n_neighbors: int = OUT_OF_SAMPLE_NEIGHBORS) -> np.ndarray:
+    """
+    Coordinates of the new documents as the inverse distance weighted mean of their nearest corpus documents
+    (the initial position UMAP.transform optimises from), embedding holds the coordinates of the corpus documents
+    """
+    indices, distances = exact_neighbors(corpus_tfidf, tfidf, n_neighbors)
+    weights = 1 / np.maximum(distances, 1e-6)
+    weights /= weights.sum(axis=1, keepdims=True)
+    return np.einsum("ij,ijk->ik", weights, np.asarray(embedding)[indices])
+
+
+def nmf_fold_in(tfidf: sparse.csr_matrix, topics: np.ndarray) -> np.ndarray:
+    """
+    Best topic of every new document, the document x topic weights are fitted to the fixed topics x words matrix
+    """
+    from sklearn.decomposition import non_negative_factorization
+
+    weights, _, _ = non_negative_factorization(tfidf, H=np.asarray(topics, dtype=np.float64),
+                                               n_components=topics.shape[0], update_H=False)
+    return np.argmax(weights, axis=1)
+
+
+def lda_fold_in(counts: sparse.csr_matrix, topics: np.ndarray, max_iter: int = 100, tol: float = 1e-3) -> np.ndarray:
+    """
+    Best topic of every new document by the variational E-step of LDA with the fixed topic word
+    parameters (LatentDirichletAllocation.components_), the document topic prior is 1 / topics as in sklearn
+    """
+    from scipy.special import psi
+
+    topics = np.asarray(topics, dtype=np.float64)
+    n_topics = topics.shape[0]
+    doc_topic_prior = 1 / n_topics
+    exp_topic_word = np.exp(psi(topics) - psi(topics.sum(axis=1))[:, np.newaxis])
+    counts = sparse.csr_matrix(counts)
+    doc_topics = np.empty(counts.shape[0], dtype=np.int64)
+    for doc in range(counts.shape[0]):
+        words = counts.indices[counts.indptr[doc]:counts.indptr[doc + 1]]
+        word_counts = counts.data[counts.indptr[doc]:counts.indptr[doc + 1]].astype(np.float64)
+        exp_word = exp_topic_word[:, words]
+        gamma = np.ones(n_topics)
+        for _ in range(max_iter):
+            exp_doc = np.exp(psi(gamma) - psi(gamma.sum()))
+            norm_phi = exp_doc @ exp_word + 1e-100
+            previous, gamma = gamma, doc_topic_prior + exp_doc * (exp_word @ (word_counts / norm_phi))
+            if np.mean(np.abs(gamma - previous)) < tol:
+                break
+        doc_topics[doc] = np.argmax(gamma)
+    return doc_topics
@@ -0,0 +1,55 @@
+from typing import Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+
+def _centered_dot(matrix, mean: np.ndarray, other: np.ndarray) -> np.ndarray:
+    # (matrix - mean) @ other without ever forming the centered (dense) matrix
+    return matrix @ other - mean @ other
+
+
+def _centered_rdot(matrix, mean: np.ndarray, other: np.ndarray) -> np.ndarray:
+    # (matrix - mean).T @ other
+    return matrix.T @ other - np.outer(mean, other.sum(axis=0))
+
+
+def randomized_pca(matrix, n_components: int = 2, n_oversamples: int = 20, n_iter: int = 7,
+                   random_state: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    PCA by randomized truncated SVD (Halko, Martinsson, Tropp: Finding structure with randomness, 2011).
+    Works directly on the sparse matrix, the centering is applied implicitly in every product, so neither the
+    dense matrix nor the words X words covariance is ever built. Only the top n_components are computed.
+
+    Returns the projection of the (uncentered) rows onto the principal axes, the principal axes
+    (n_components X n_features) and the explained variances.
+    """
+    if sparse.issparse(matrix):
+        matrix = matrix.tocsr()
+    n_samples, n_features = matrix.shape
+    mean = np.asarray(matrix.mean(axis=0)).ravel()
+    n_random = min(n_components + n_oversamples, n_samples, n_features)
+    rng = np.random.default_rng(random_state)
+
+    # range finder with power iterations, re-orthonormalized after every product for stability
+    sample = _centered_dot(matrix, mean, rng.standard_normal((n_features, n_random)))
+    for _ in range(n_iter):
+        sample, _ = np.linalg.qr(sample)
+        sample, _ = np.linalg.qr(_centered_rdot(matrix, mean, sample))
+        sample = _centered_dot(matrix, mean, sample)
+    basis, _ = np.linalg.qr(sample)
+
+    # exact SVD of the small projected matrix basis.T @ (matrix - mean)
+    small = _centered_rdot(matrix, mean, basis).T
+    _, singular_values, components = np.linalg.svd(small, full_matrices=False)
+    components = components[:n_components]
+    singular_values = singular_values[:n_components]
+
+    # fix the signs (largest loading positive) to get deterministic output
+    signs = np.sign(components[np.arange(components.shape[0]), np.argmax(np.abs(components), axis=1)])
+    signs[signs == 0] = 1
+    components *= signs[:, np.newaxis]
+
+    explained_variance = singular_values ** 2 / max(n_samples - 1, 1)
+    projection = np.asarray(matrix @ components.T)
+    return projection, components, explained_variance
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import time
+import zipfile
+from typing import Dict, Optional
+
+import numpy as np
+
+from src.tracing import traced
+
+RESULT_CACHE_DIR = "./precomputed/cache"
+RESULT_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+
+class ResultCache():
+    """
+    Content-addressed cache of the computed embeddings and topics.
+    Entries are keyed by a hash of the input matrix fingerprint and all the solver parameters, every entry is
+    one .npz file with the arrays plus a .json metadata sidecar. When the cache grows over max_bytes the least
+    recently used entries are evicted.
+    """
+    def __init__(self, cache_dir: str = RESULT_CACHE_DIR, max_bytes: int = RESULT_CACHE_MAX_BYTES) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(fingerprint: str, params: dict) -> str:
+        description = json.dumps({"fingerprint": fingerprint, "params": params}, sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _data_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(self._data_path(key))
+
+    @traced("result cache get")
+    def get(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Return the cached arrays or None on a miss, a hit refreshes the entry for the LRU eviction
+        """
+        path = self._data_path(key)
+        try:
+            with np.load(path) as npz:
+                arrays = {name: npz[name] for name in npz.files}
+        except (OSError, ValueError, zipfile.BadZipFile):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # read-only cache (e.g. a shipped warmed one), the entry is used without the LRU refresh
+
+        self.hits += 1
+        return arrays
+
+    def get_meta(self, key: str) -> Optional[dict]:
+        try:
+            with open(self._meta_path(key), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @traced("result cache put")
+    def put(self, key: str, arrays: Dict[str, np.ndarray], meta: Optional[dict] = None) -> None:
+        """
+        Store the arrays atomically (written to a temporary file which is then renamed) and evict old entries
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        meta = dict(meta or {}, key=key, created=time.time(),
+                    arrays={name: [list(array.shape), array.dtype.str] for name, array in arrays.items()})
+        self._write_atomic(self._meta_path(key), lambda f: f.write(json.dumps(meta, indent=2).encode()))
+        self._write_atomic(self._data_path(key), lambda f: np.savez(f, **arrays))
+        self.evict(keep=key)
+
+    def _write_atomic(self, path: str, write) -> None:
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        try:
+            with open(tmp_path, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _entries(self):
+        # (last access, size, key) of all entries
+        entries = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(".npz"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name[:-len(".npz")]))
+        return entries
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """
+        Remove the least recently used entries until the cache fits into max_bytes
+        """
+        entries = sorted(self._entries())
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            for path in (self._data_path(key), self._meta_path(key)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total_bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        requests = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "entries": len(entries), "bytes": sum(size for _, size, _ in entries)}
+
+
+DEFAULT_RESULT_CACHE = ResultCache()
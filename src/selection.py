@@ -0,0 +1,97 @@
+import hashlib
+from typing import Callable, List
+
+import numpy as np
+
+
+class DocumentSelection():
+    """
+    Set of the selected documents backed by a boolean mask over all the documents.
+    It is shared by the scene, the table and the data layer; every change is reported to the listeners
+    as a delta (added ids, removed ids), so they can update themselves in O(delta).
+    """
+    def __init__(self, n_docs: int) -> None:
+        self.mask = np.zeros(n_docs, dtype=bool)
+        self.count = 0
+        self.listeners: List[Callable[[np.ndarray, np.ndarray], None]] = []
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, doc_id) -> bool:
+        return bool(self.mask[doc_id])
+
+    def ids(self) -> np.ndarray:
+        """
+        Sorted ids of the selected documents
+        """
+        return np.flatnonzero(self.mask)
+
+    def digest(self) -> str:
+        """
+        Hash of the selected documents, equal selections have equal digests
+        """
+        return hashlib.sha1(np.packbits(self.mask).tobytes()).hexdigest()
+
+    def grow(self, n_docs: int) -> None:
+        """
+        Extend the set of documents to n_docs (for the added documents), they start unselected
+        """
+        self.mask = np.concatenate([self.mask, np.zeros(n_docs - self.mask.shape[0], dtype=bool)])
+
+    def subscribe(self, listener: Callable[[np.ndarray, np.ndarray], None]) -> None:
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[np.ndarray, np.ndarray], None]) -> None:
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def _ids(self, ids) -> np.ndarray:
+        return np.unique(np.asarray(ids, dtype=np.int64))
+
+    def _apply(self, added: np.ndarray, removed: np.ndarray) -> bool:
+        if not added.shape[0] and not removed.shape[0]:
+            return False
+        self.mask[removed] = False
+        self.mask[added] = True
+        self.count += added.shape[0] - removed.shape[0]
+        for listener in self.listeners:
+            listener(added, removed)
+        return True
+
+    def toggle(self, doc_id: int) -> bool:
+        doc_ids = np.array([doc_id], dtype=np.int64)
+        if self.mask[doc_id]:
+            return self._apply(np.empty(0, dtype=np.int64), doc_ids)
+        return self._apply(doc_ids, np.empty(0, dtype=np.int64))
+
+    def add(self, ids) -> bool:
+        """
+        Union with ids, returns whether the selection changed
+        """
+        ids = self._ids(ids)
+        return self._apply(ids[~self.mask[ids]], np.empty(0, dtype=np.int64))
+
+    def remove(self, ids) -> bool:
+        ids = self._ids(ids)
+        return self._apply(np.empty(0, dtype=np.int64), ids[self.mask[ids]])
+
+    def intersect(self, ids) -> bool:
+        """
+        Keep only the selected documents which are also in ids
+        """
+        keep = np.zeros_like(self.mask)
+        keep[self._ids(ids)] = True
+        return self._apply(np.empty(0, dtype=np.int64), np.flatnonzero(self.mask & ~keep))
+
+    def set(self, ids) -> bool:
+        """
+        Replace the selection by ids
+        """
+        ids = self._ids(ids)
+        new_mask = np.zeros_like(self.mask)
+        new_mask[ids] = True
+        return self._apply(np.flatnonzero(new_mask & ~self.mask), np.flatnonzero(self.mask & ~new_mask))
+
+    def clear(self) -> bool:
+        return self._apply(np.empty(0, dtype=np.int64), self.ids())
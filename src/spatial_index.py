@@ -0,0 +1,123 @@
+import numpy as np
+
+
+class GridIndex():
+    """
+    Uniform grid over 2D points for fast range queries.
+    The points are sorted by their cell (row by row), so the points of consecutive cells in one grid row form
+    one contiguous slice and a rectangle query touches only the rows it spans plus the k points it returns.
+    """
+    def __init__(self, points: np.ndarray, cell_size: float = 16.0) -> None:
+        self.points = np.asarray(points, dtype=np.float64)
+        self.cell_size = cell_size
+        if self.points.shape[0]:
+            self.origin = self.points.min(axis=0)
+            cells = self._cells(self.points)
+            self.n_cols, self.n_rows = cells.max(axis=0) + 1
+        else:
+            self.origin = np.zeros(2)
+            cells = np.zeros((0, 2), dtype=np.int64)
+            self.n_cols, self.n_rows = 1, 1
+
+        cell_ids = cells[:, 1] * self.n_cols + cells[:, 0]
+        self.order = np.argsort(cell_ids, kind="stable")
+        # points of the cell c are self.order[self.cell_start[c]:self.cell_start[c + 1]]
+        self.cell_start = np.searchsorted(cell_ids[self.order], np.arange(self.n_cols * self.n_rows + 1))
+
+    def _cells(self, points: np.ndarray) -> np.ndarray:
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+
+    def query_rect(self, x_min: float, y_min: float, x_max: float, y_max: float) -> np.ndarray:
+        """
+        Sorted ids of the points with x_min <= x <= x_max and y_min <= y <= y_max
+        """
+        if x_max < x_min or y_max < y_min:
+            return np.empty(0, dtype=np.int64)
+        (col_min, row_min), (col_max, row_max) = self._cells(np.array([[x_min, y_min], [x_max, y_max]]))
+        col_min, row_min = max(col_min, 0), max(row_min, 0)
+        col_max, row_max = min(col_max, self.n_cols - 1), min(row_max, self.n_rows - 1)
+        if col_min > col_max or row_min > row_max:
+            return np.empty(0, dtype=np.int64)
+
+        slices = [self.order[self.cell_start[row * self.n_cols + col_min]:self.cell_start[row * self.n_cols + col_max + 1]]
+                  for row in range(row_min, row_max + 1)]
+        candidates = np.concatenate(slices)
+        x, y = self.points[candidates, 0], self.points[candidates, 1]
+        inside = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+        return np.sort(candidates[inside])
+
+    def nearest(self, x: float, y: float, max_distance: float):
+        """
+        Id of the point nearest to (x, y) within max_distance, None if there is no such point
+        """
+        candidates = self.query_rect(x - max_distance, y - max_distance, x + max_distance, y + max_distance)
+        if not candidates.shape[0]:
+            return None
+        distances = np.hypot(self.points[candidates, 0] - x, self.points[candidates, 1] - y)
+        best = np.argmin(distances)
+        return int(candidates[best]) if distances[best] <= max_distance else None
+
+    def count_rect(self, x_min: float, y_min: float, x_max: float, y_max: float) -> int:
+        return self.query_rect(x_min, y_min, x_max, y_max).shape[0]
+
+
+class DensityPyramid():
+    """
+    Multi-resolution grid of per-topic point counts, the cell size doubles with every level.
+    Used to draw density tiles instead of the individual points when zoomed out.
+    """
+    def __init__(self, points: np.ndarray, topics: np.ndarray, n_topics: int,
+                 base_cell_size: float = 2.0, n_levels: int = 6) -> None:
+        points = np.asarray(points, dtype=np.float64)
+        self.n_topics = n_topics
+        self.origin = points.min(axis=0) if points.shape[0] else np.zeros(2)
+        self.cell_sizes = [base_cell_size * 2 ** level for level in range(n_levels)]
+        self.counts = []  # per level (n_topics, rows, cols)
+        for cell_size in self.cell_sizes:
+            cells = np.floor((points - self.origin) / cell_size).astype(np.int64)
+            n_cols, n_rows = (cells.max(axis=0) + 1) if points.shape[0] else (1, 1)
+            flat = (topics * n_rows + cells[:, 1]) * n_cols + cells[:, 0]
+            counts = np.bincount(flat, minlength=n_topics * n_rows * n_cols).astype(np.int32)
+            self.counts.append(counts.reshape(n_topics, n_rows, n_cols))
+
+        # summed-area table of the finest level, for counting the points in a rectangle in O(1)
+        total = self.counts[0].sum(axis=0)
+        self.summed_area = np.zeros((total.shape[0] + 1, total.shape[1] + 1), dtype=np.int64)
+        self.summed_area[1:, 1:] = total.cumsum(axis=0).cumsum(axis=1)
+
+    def level_for(self, pixels_per_unit: float, min_cell_pixels: float) -> int:
+        """
+        The finest level whose cells are at least min_cell_pixels large on the screen
+        """
+        for level, cell_size in enumerate(self.cell_sizes):
+            if cell_size * pixels_per_unit >= min_cell_pixels:
+                return level
+        return len(self.cell_sizes) - 1
+
+    def count_rect(self, x_min: float, y_min: float, x_max: float, y_max: float) -> int:
+        """
+        Number of points in the finest cells overlapping the rectangle (approximate at its borders)
+        """
+        cell_size = self.cell_sizes[0]
+        n_rows, n_cols = self.summed_area.shape[0] - 1, self.summed_area.shape[1] - 1
+        col_min = int(np.clip(np.floor((x_min - self.origin[0]) / cell_size), 0, n_cols))
+        col_max = int(np.clip(np.floor((x_max - self.origin[0]) / cell_size) + 1, 0, n_cols))
+        row_min = int(np.clip(np.floor((y_min - self.origin[1]) / cell_size), 0, n_rows))
+        row_max = int(np.clip(np.floor((y_max - self.origin[1]) / cell_size) + 1, 0, n_rows))
+        sat = self.summed_area
+        return int(sat[row_max, col_max] - sat[row_min, col_max] - sat[row_max, col_min] + sat[row_min, col_min])
+
+    def rgba(self, level: int, colors: np.ndarray, min_alpha: float = 0.35) -> np.ndarray:
+        """
+        (rows, cols, 4) uint8 image of the level: the colour of the dominant topic of every cell and
+        the opacity growing with the (log) number of points in it
+        """
+        counts = self.counts[level]
+        total = counts.sum(axis=0)
+        image = np.zeros(total.shape + (4,), dtype=np.uint8)
+        image[..., :3] = colors[np.argmax(counts, axis=0)]
+        occupied = total > 0
+        if occupied.any():
+            density = np.log1p(total) / np.log1p(total.max())
+            image[..., 3] = np.where(occupied, 255 * (min_alpha + (1 - min_alpha) * density), 0).astype(np.uint8)
+        return image
@@ -0,0 +1,196 @@
+"""
+Out-of-core processing of the corpora larger than the memory (NYTimes, PubMed).
+The docword file is read in chunks of whole documents (the UCI files are ordered by documents), the compiled corpus
+is written piece by piece into memory-mapped files and the topics are fitted on mini-batches of its rows.
+The memory stays bounded by the chunk sizes, the peak is tracked by MemoryTracker.
+"""
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+import psutil
+from scipy import sparse
+from sklearn.decomposition import LatentDirichletAllocation, MiniBatchNMF
+
+from src.corpus_store import CorpusWriter, fingerprint_arrays
+from src.data_utils import COUNT_DTYPE, TFIDF_PARAMS, read_docword_header
+from src.out_of_sample import tfidf_rows
+
+STREAM_CHUNK_DOCS = 20000  # documents per chunk
+STREAM_CHUNK_BYTES = 1 << 22  # the docword file is read in 4 MB blocks
+
+
+class MemoryTracker():
+    """
+    High-water mark of the resident memory of the process, sampled after every chunk.
+    The resident pages of the memory-mapped files are left out (where the OS reports them), they are only a cache
+    which the OS drops under memory pressure.
+    """
+    def __init__(self) -> None:
+        self.process = psutil.Process()
+        self.peak = 0
+        self.baseline = self.sample()
+
+    def sample(self) -> int:
+        info = self.process.memory_info()
+        used = info.rss - getattr(info, "shared", 0)
+        self.peak = max(self.peak, used)
+        return used
+
+    def report(self) -> str:
+        return f"peak memory {self.peak / 2 ** 20:.0f} MB (+{(self.peak - self.baseline) / 2 ** 20:.0f} MB)"
+
+
+def iter_docword_chunks(docword_path: str, chunk_docs: int = STREAM_CHUNK_DOCS,
+                        chunk_bytes: int = STREAM_CHUNK_BYTES) -> Iterator[Tuple[int, sparse.csr_matrix]]:
+    """
+    Read the UCI docword file in chunks of whole documents.
+    Yields (first document, CSR counts of the next documents), the chunks cover all the documents in order.
+    Only one block of the file and one chunk of documents are held in memory.
+    """
+    with open(docword_path, "rb") as f:
+        n_docs, n_words, n_nonzero_counts = read_docword_header(f)
+        pending = np.empty((0, 3), dtype=np.int64)  # (doc, word, count) triplets of the unfinished chunk
+        start = 0  # first document of the next chunk
+        n_values = 0
+        rest = b""
+        eof = False
+        while not eof:
+            block = f.read(chunk_bytes)
+            eof = not block
+            block = rest + block
+            # only complete lines are parsed, the rest is prepended to the next block
+            last_newline = block.rfind(b"\n") if not eof else len(block) - 1
+            rest = block[last_newline + 1:]
+            values = np.fromstring(block[:last_newline + 1], dtype=np.int64, sep=" ")
+            if values.shape[0] % 3:
+                raise ValueError(f"{docword_path}: malformed (doc, word, count) line")
+            n_values += values.shape[0]
+            triplets = values.reshape(-1, 3)
+            triplets[:, :2] -= 1  # zero based ids
+            pending = np.concatenate([pending, triplets])
+
+            doc_ids = pending[:, 0]
+            if doc_ids.shape[0] and (doc_ids[0] < start or np.any(doc_ids[1:] < doc_ids[:-1])):
+                raise ValueError(f"{docword_path}: the counts are not ordered by documents, it cannot be streamed")
+            # the last document of the block may continue in the next one
+            end = n_docs if eof else (int(doc_ids[-1]) if doc_ids.shape[0] else start)
+            while end - start >= chunk_docs or (eof and start < end):
+                stop = min(start + chunk_docs, end)
+                n = np.searchsorted(doc_ids, stop)
+                chunk = pending[:n]
+                if n and (chunk[-1, 0] >= n_docs or chunk[:, 1].min() < 0 or chunk[:, 1].max() >= n_words):
+                    raise ValueError(f"{docword_path}: ids out of the ranges given by the header")
+                if n and chunk[:, 2].min() <= 0:
+                    raise ValueError(f"{docword_path}: counts have to be positive")
+                # duplicated (doc, word) pairs are summed up by the conversion
+                counts = sparse.coo_matrix((chunk[:, 2].astype(COUNT_DTYPE), (chunk[:, 0] - start, chunk[:, 1])),
+                                           shape=(stop - start, n_words)).tocsr()
+                counts.sort_indices()
+                yield start, counts
+                pending, doc_ids = pending[n:], doc_ids[n:]
+                start = stop
+
+    if n_values != 3 * n_nonzero_counts:
+        raise ValueError(f"{docword_path}: expected {n_nonzero_counts} nonzero counts, found {n_values / 3:g}")
+
+
+def corpus_idf(document_frequencies: np.ndarray, n_docs: int, params: dict) -> np.ndarray:
+    """
+    The idf TfidfTransformer(**params) fits from the document frequencies (ones without use_idf)
+    """
+    if not params.get("use_idf", True):
+        return np.ones(document_frequencies.shape[0])
+    if params.get("smooth_idf", True):
+        return np.log((1 + n_docs) / (1 + document_frequencies)) + 1
+    return np.log(n_docs / document_frequencies) + 1
+
+
+def build_corpus_streaming(docword_path: str, corpus_dir: str, vocab_offsets: np.ndarray, vocab_blob: np.ndarray,
+                           meta: dict, chunk_docs: int = STREAM_CHUNK_DOCS,
+                           memory: Optional[MemoryTracker] = None) -> None:
+    """
+    Compile the corpus (see DocumentData._build_corpus) without holding the matrices in memory.
+    The first pass writes the counts and collects the document frequencies, the second pass computes the
+    TF-IDF (with TFIDF_PARAMS, as the in-memory TfidfTransformer) of the written counts chunk by chunk.
+    """
+    memory = memory if memory is not None else MemoryTracker()
+    with open(docword_path, "rb") as f:
+        n_docs, n_words, n_nonzero_counts = read_docword_header(f)
+
+    # the index dtype scipy would choose for the whole matrix, so the fingerprint equals the in-memory one
+    index_dtype = np.int32 if max(n_docs, n_words, n_nonzero_counts) < 2 ** 31 else np.int64
+    writer = CorpusWriter(corpus_dir)
+    try:
+        indptr = writer.create("counts_indptr", (n_docs + 1,), index_dtype)
+        indices = writer.create("counts_indices", (n_nonzero_counts,), index_dtype)
+        data = writer.create("counts_data", (n_nonzero_counts,), COUNT_DTYPE)
+        indptr[0] = 0
+        document_frequencies = np.zeros(n_words, dtype=np.int64)
+        term_totals = np.zeros(n_words, dtype=np.int64)
+        n_stored = 0
+        for start, counts in iter_docword_chunks(docword_path, chunk_docs):
+            indices[n_stored:n_stored + counts.nnz] = counts.indices
+            data[n_stored:n_stored + counts.nnz] = counts.data
+            indptr[start + 1:start + counts.shape[0] + 1] = counts.indptr[1:] + n_stored
+            n_stored += counts.nnz
+            document_frequencies += np.bincount(counts.indices, minlength=n_words)
+            term_totals += np.bincount(counts.indices, weights=counts.data, minlength=n_words).astype(np.int64)
+            memory.sample()
+        indptr.flush()
+        indices.flush()
+        data.flush()
+        del indices, data
+        # duplicated pairs were merged, fewer values than declared in the header
+        indices = writer.shrink("counts_indices", n_stored)
+        data = writer.shrink("counts_data", n_stored)
+
+        idf = corpus_idf(document_frequencies, n_docs, TFIDF_PARAMS)
+        tfidf_data = writer.create("tfidf_data", (n_stored,), np.float64)
+        for start in range(0, n_docs, chunk_docs):
+            stop = min(start + chunk_docs, n_docs)
+            first, last = indptr[start], indptr[stop]
+            chunk = sparse.csr_matrix((data[first:last], indices[first:last], indptr[start:stop + 1] - first),
+                                      shape=(stop - start, n_words))
+            tfidf_data[first:last] = tfidf_rows(chunk, idf, TFIDF_PARAMS).data
+            memory.sample()
+        tfidf_data.flush()
+
+        writer.save("idf", idf)
+        writer.save("term_totals", term_totals)
+        writer.save("vocab_offsets", vocab_offsets)
+        writer.save("vocab_blob", vocab_blob)
+        fingerprint = fingerprint_arrays(indptr, indices, data, vocab_offsets, vocab_blob)
+        meta = dict(meta, n_docs=n_docs, n_words=n_words, n_nonzero_counts=n_stored, fingerprint=fingerprint)
+        del indptr, indices, data, tfidf_data  # close the memory maps before the directory is renamed
+    except BaseException:
+        writer.abort()
+        raise
+    writer.commit(meta)
+
+
+def fit_topics_streaming(counts: sparse.csr_matrix, tfidf: sparse.csr_matrix, solver: str, n_components: int,
+                         random_state: int, chunk_docs: int = STREAM_CHUNK_DOCS,
+                         memory: Optional[MemoryTracker] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fit the topics on mini-batches of rows of the (memory-mapped) matrices: mini-batch NMF of the TF-IDF or
+    online LDA of the counts. Returns the best topic of every document and the topics x words matrix.
+    """
+    memory = memory if memory is not None else MemoryTracker()
+    n_docs = counts.shape[0]
+    if solver == "nmf":
+        model = MiniBatchNMF(n_components=n_components, random_state=random_state)
+        matrix = tfidf
+    else:
+        model = LatentDirichletAllocation(n_components=n_components, learning_method="online",
+                                          total_samples=n_docs, random_state=random_state)
+        matrix = counts
+
+    for start in range(0, n_docs, chunk_docs):
+        model.partial_fit(matrix[start:start + chunk_docs])
+        memory.sample()
+
+    doc_topics = np.empty(n_docs, dtype=np.int64)
+    for start in range(0, n_docs, chunk_docs):
+        doc_topics[start:start + chunk_docs] = np.argmax(model.transform(matrix[start:start + chunk_docs]), axis=1)
+        memory.sample()
+    return doc_topics, model.components_
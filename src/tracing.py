@@ -0,0 +1,180 @@
+"""
+Tracing of the hot paths: named nested spans (parsing, TF-IDF, cache lookups, scene and table construction, ...)
+timed with perf_counter_ns. The breakdown of the last finished top level span is reported to the listeners
+(the status bar) and all the recorded spans can be exported in the Chrome trace event format
+(chrome://tracing, https://ui.perfetto.dev).
+Disabled (the default, enable with DOCVIS_TRACE=1 or from the menu) a span costs one attribute check
+and entering a shared no-op context manager.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from functools import wraps
+from typing import Callable, List, Optional
+
+TRACE_ENV = "DOCVIS_TRACE"
+MAX_EVENTS = 100000  # the oldest spans are dropped from the exported trace
+BREAKDOWN_MIN_SECONDS = 0.0005  # shorter child spans are left out of the breakdown
+
+_NO_SPAN = nullcontext()
+
+
+class Span():
+    __slots__ = ("tracer", "name", "args", "start", "duration", "depth", "children")
+
+    def __init__(self, tracer: "Tracer", name: str, args: dict) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0
+        self.duration = 0
+        self.depth = 0
+        self.children = []
+
+    @property
+    def seconds(self) -> float:
+        return self.duration / 1e9
+
+    def __enter__(self) -> "Span":
+        stack = self.tracer._stack()
+        self.depth = len(stack)
+        stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.duration = time.perf_counter_ns() - self.start
+        stack = self.tracer._stack()
+        stack.pop()
+        if stack:
+            stack[-1].children.append(self)
+        self.tracer._finish(self, not stack)
+
+
+class Tracer():
+    """
+    Recorder of the spans of all the threads, every thread nests its own spans
+    """
+    def __init__(self, enabled: bool = False, max_events: int = MAX_EVENTS) -> None:
+        self.enabled = enabled
+        self.events = deque(maxlen=max_events)  # (name, start ns, duration ns, thread id, thread name, args)
+        self.last_operation: Optional[Span] = None
+        self.listeners: List[Callable[[Span], None]] = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def span(self, name: str, **args):
+        """
+        Context manager timing the block as the span name, args are shown with the span in the trace viewer
+        """
+        if not self.enabled:
+            return _NO_SPAN
+        return Span(self, name, args)
+
+    def traced(self, name: Optional[str] = None):
+        """
+        Decorator timing every call of the function as a span (named after the function by default)
+        """
+        def decorator(function):
+            span_name = name or function.__qualname__
+
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with Span(self, span_name, {}):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def subscribe(self, listener: Callable[[Span], None]) -> None:
+        """
+        The listener is called with every finished top level span (from the thread which ran it)
+        """
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[Span], None]) -> None:
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.events.clear()
+            self.last_operation = None
+
+    def _stack(self) -> List[Span]:
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def _finish(self, span: Span, top_level: bool) -> None:
+        thread = threading.current_thread()
+        with self.lock:
+            self.events.append((span.name, span.start, span.duration, thread.ident, thread.name, span.args))
+            if top_level:
+                self.last_operation = span
+        if top_level:
+            for listener in self.listeners:
+                listener(span)
+
+    def chrome_trace(self) -> dict:
+        """
+        The recorded spans as Chrome trace events (complete events, microseconds)
+        """
+        pid = os.getpid()
+        with self.lock:
+            events = list(self.events)
+        trace_events = []
+        thread_names = {}
+        for name, start, duration, thread_id, thread_name, args in events:
+            thread_names[thread_id] = thread_name
+            trace_events.append({"name": name, "cat": "docvis", "ph": "X", "ts": start / 1000, "dur": duration / 1000,
+                                 "pid": pid, "tid": thread_id, "args": {k: str(v) for k, v in args.items()}})
+        for thread_id, thread_name in thread_names.items():
+            trace_events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": thread_id,
+                                 "args": {"name": thread_name}})
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path: str) -> int:
+        """
+        Write the recorded spans as a Chrome trace JSON file, returns the number of the spans
+        """
+        trace = self.chrome_trace()
+        with open(path, "w") as f:
+            json.dump(trace, f)
+        return sum(event["ph"] == "X" for event in trace["traceEvents"])
+
+
+def format_breakdown(span: Span, max_depth: int = 2) -> str:
+    """
+    One line breakdown of a span, e.g. "plot 52.1 ms: generateAndMapData 40.3 ms (document cloud 21.0 ms), table ...",
+    repeated child spans of one name are summed up (e.g. "result cache get 3.1 ms x5")
+    """
+    def children(parent: Span, depth: int) -> str:
+        groups = {}  # name -> child spans, in the order of the first call
+        for child in parent.children:
+            groups.setdefault(child.name, []).append(child)
+        parts = []
+        for name, spans in groups.items():
+            seconds = sum(child.seconds for child in spans)
+            if seconds < BREAKDOWN_MIN_SECONDS:
+                continue
+            if len(spans) > 1:
+                parts.append(f"{name} {seconds * 1000:.1f} ms x{len(spans)}")
+                continue
+            inner = children(spans[0], depth + 1) if depth < max_depth else ""
+            parts.append(f"{name} {seconds * 1000:.1f} ms" + (f" ({inner})" if inner else ""))
+        return ", ".join(parts)
+
+    inner = children(span, 1)
+    return f"{span.name} {span.seconds * 1000:.1f} ms" + (f": {inner}" if inner else "")
+
+
+# the tracer of the application
+TRACER = Tracer(enabled=os.environ.get(TRACE_ENV, "0") not in ("", "0"))
+span = TRACER.span
+traced = TRACER.traced
@@ -1,16 +1,24 @@
+from collections import OrderedDict
+from typing import Literal
+
 import numpy as np
-from PySide6.QtCore import QRectF
+from PySide6.QtCore import QRectF, QTimer
 from PySide6.QtGui import QBrush, QFont, Qt
-from PySide6.QtWidgets import (QGraphicsScene, QGraphicsTextItem,
+from PySide6.QtWidgets import (QGraphicsScene, QGraphicsSimpleTextItem,
                                QGraphicsView, QHBoxLayout, QLabel, QPushButton,
                                QVBoxLayout, QWidget)
 
 from src.data_utils import DocumentData
+from src.tracing import traced
+from src.wordcloud_layout import TEXT_MARGIN, WordCloudLayout
 
 COLORS = [
     Qt.darkYellow, Qt.green, Qt.blue, Qt.red, Qt.cyan, Qt.magenta,
     Qt.gray, Qt.darkYellow, Qt.darkGreen, Qt.darkBlue, Qt.darkRed, Qt.darkCyan
 ]
+MIN_FONT_SIZE = 10  # smaller words are left out
+WORDCLOUD_CACHE_SIZE = 8  # number of the rendered clouds kept by the window
+REFRESH_DELAY_MS = 300  # delay of the live refresh after a selection change
 
 
 def normalise(array):
@@ -18,9 +26,10 @@ def normalise(array):
 
 
 class WordCloudWindow(QWidget):
-    def __init__(self, document_data: DocumentData):
+    def __init__(self, document_data: DocumentData, layout_method: Literal["rows", "spiral"] = "rows"):
         super().__init__()
         self.document_data = document_data
+        self.layout_method = layout_method  # rows from the top left, or a spiral around the centre
         self.generated_topic_wordcloud = False
 
         # Set it as window
@@ -46,14 +55,19 @@ class WordCloudWindow(QWidget):
         self.menu.addWidget(self.topic_wordcloud_button)
         # self.menu.addWidget(separator)
 
-        # Set the wordcloud scene
-        self.scene = QGraphicsScene()
-        self.scene.setSceneRect(QRectF(0, 0, 800, 600))  # Set the desired width and height
+        # Set the wordcloud scene, every rendered cloud keeps its own scene (see refresh)
+        self.clouds = OrderedDict()  # cloud key -> scene, the least recently shown first
+        self.scene = None
+        self.word_layout = WordCloudLayout(800, 600)
         self.view = QGraphicsView()
         self.view.setBackgroundBrush(QBrush(Qt.white))
         self.view.setGeometry(0, 0, 800, 600)
-        self.view.setScene(self.scene)
-        self._generate_words_from_g2()
+
+        # selection changes are coalesced, the cloud is refreshed once the selection settles
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(REFRESH_DELAY_MS)
+        self.refresh_timer.timeout.connect(self.refresh)
 
         # Set status bar
         self.status_bar = QHBoxLayout()
@@ -62,8 +76,8 @@ class WordCloudWindow(QWidget):
         self.text1 = ("\tThe Wordcloud was generated from the selected document "
                  "using the g2 algorithm. It compares selected and unselected documents.\n\t\t\t\tThe colors of words "
                  "corresponds with the topic it belongs to the most.")
-        self.text2 = (f"\tThe Wordcloud was generated from words describing the prevalent topic among selected document "
-                 f"(or the whole corpus). \n\t  Topics were determined by selected {self.document_data.topics_method} algorithm."
+        self.text2 = ("\tThe Wordcloud was generated from words describing the prevalent topic among selected document "
+                 "(or the whole corpus). \n\t  Topics were determined by selected {} algorithm."
                  "The words of different color are stronger connected to different topic.")
         self.label1 = QLabel(self.text1)
         # Set the position and size of the label
@@ -88,35 +102,79 @@ class WordCloudWindow(QWidget):
         self.layout.addLayout(self.menu)
         self.layout.addWidget(self.view)
         self.setLayout(self.layout)
+        self.refresh()
+
+    def set_document_data(self, document_data: DocumentData):
+        """
+        Show the clouds of other data, the clouds of the previous data are dropped
+        """
+        self.document_data = document_data
+        self.clouds.clear()
+        self.refresh()
+
+    def schedule_refresh(self):
+        self.refresh_timer.start()
+
+    @traced("wordcloud refresh")
+    def refresh(self):
+        """
+        Show the cloud of the current mode, selection and topics, it is rendered only if it is not memoized
+        """
+        self.refresh_timer.stop()
+        if self.document_data.topics is None:  # the topics are still being computed
+            return
+        topic_model_id = self.document_data.topic_model_id
+        if self.generated_topic_wordcloud:
+            self.label1.setText(self.text2.format(self.document_data.topics_method))
+            # the topic cloud depends only on the prevalent topic of the selection
+            key = ("topic", topic_model_id, int(np.argmax(self.document_data.topic_histogram())))
+        else:
+            self.label1.setText(self.text1)
+            # G2 compares the selection with the rest of the corpus, added documents change it
+            key = ("selection", topic_model_id, self.document_data.n_docs, self.document_data.selection.digest())
+
+        scene = self.clouds.get(key)
+        if scene is None:
+            scene = QGraphicsScene()
+            scene.setSceneRect(QRectF(0, 0, 800, 600))  # Set the desired width and height
+            self.scene = scene
+            if self.generated_topic_wordcloud:
+                self._generate_words_from_topic()
+            else:
+                self._generate_words_from_g2()
+            self.clouds[key] = scene
+            while len(self.clouds) > WORDCLOUD_CACHE_SIZE:
+                self.clouds.popitem(last=False)
+        else:
+            self.clouds.move_to_end(key)
+        self.scene = scene
+        self.view.setScene(scene)
 
     def generate_selection_wordcloud(self):
         if self.generated_topic_wordcloud:
             self.generated_topic_wordcloud = False
             self.selection_wordcloud_button.setStyleSheet(self.pushed_styledheet)
             self.topic_wordcloud_button.setStyleSheet("")
-            self.label1.setText(self.text1)
-            self._generate_words_from_g2()
+            self.refresh()
 
     def generate_topic_wordcloud(self):
         if not self.generated_topic_wordcloud:
             self.generated_topic_wordcloud = True
             self.topic_wordcloud_button.setStyleSheet(self.pushed_styledheet)
             self.selection_wordcloud_button.setStyleSheet("")
-            self.label1.setText(self.text2)
-            self._generate_words_from_topic()
+            self.refresh()
 
     def _get_text_item(self, idx, font_size):
         text = self.document_data.vocabulary[idx]
         best_topic = self.document_data.get_words_best_topic(idx)
         color = self.document_data.brush[best_topic].color()
-        # Create a QGraphicsTextItem
-        text_item = QGraphicsTextItem(text + " ")
-        # Set the font size and type
-        font = QFont("Arial", font_size)  # You can choose a different font type
-        text_item.setFont(font)
+        # Create a plain text item (much cheaper than a QGraphicsTextItem with its text document)
+        text_item = QGraphicsSimpleTextItem(text + " ")
+        # Set the font size and type (the fonts are shared per size by the layout)
+        text_item.setFont(self.word_layout.font(font_size))
 
         # Set the color
-        text_item.setDefaultTextColor(color)
+        text_item.setBrush(color)
 
         return text_item
 
@@ -127,45 +185,30 @@ class WordCloudWindow(QWidget):
         self._generate_words(sorted_words, g2)
 
     def _generate_words_from_topic(self):
-        topics_of_documents = self.document_data.doc_topics
         topics = self.document_data.topics
-        selected_documents = self.document_data.selected_documents
-        if not selected_documents:
-            selected_documents = np.arange(self.document_data.n_docs, dtype=int)
-
-        counts = np.bincount(topics_of_documents[selected_documents])
+        # histogram of the topics among the selected documents (maintained incrementally)
+        counts = self.document_data.topic_histogram()
         selected_topic = np.argmax(counts)
         sizes = normalise(topics[selected_topic])
         sorted_words = np.flip(np.argsort(sizes))
         self._generate_words(sorted_words, sizes)
 
+    @traced()
     def _generate_words(self, sorted_words, sizes):
         self.scene.clear()
-        max_width = self.scene.width()
-        max_height = self.scene.height()
-        x = 0
-        y = 0
-        row_height = None
-        for idx in sorted_words:
-            # Make it a bit nonlinear, so the small words are still readable
-            # There is a lot of cases, where one word outscale the rest
-            size = sizes[idx] ** 0.9 * 100
-            if size < 10:
-                break
-            item = self._get_text_item(idx, size)
-            # print(x, y, item.boundingRect().width(), item.boundingRect().height(), item.toPlainText())
-            if item.boundingRect().width() + x <= max_width:
-                if not row_height:  # to have it aligned from the bottom
-                    row_height = item.boundingRect().height()
-                item.setPos(x, y + (row_height - item.boundingRect().height()) * 0.9)
-                x += item.boundingRect().width()
-            elif item.boundingRect().height() + row_height + y <= max_height:
-                if not row_height:
-                    row_height = item.boundingRect().height()
-                y += row_height
-                row_height = item.boundingRect().height()
-                item.setPos(0, y)
-                x = item.boundingRect().width()
-            else:
-                break
+        # Make it a bit nonlinear, so the small words are still readable
+        # There is a lot of cases, where one word outscale the rest
+        font_sizes = sizes[sorted_words] ** 0.9 * 100
+        too_small = np.flatnonzero(~(font_sizes >= MIN_FONT_SIZE))
+        n_words = too_small[0] if too_small.shape[0] else font_sizes.shape[0]
+        word_ids = sorted_words[:n_words]
+        font_sizes = font_sizes[:n_words].astype(np.int64)  # QFont takes whole point sizes
+
+        # the whole layout is computed first, the items are created only for the words which fit
+        positions, placed = self.word_layout.layout(word_ids, font_sizes, self.document_data.vocabulary,
+                                                    self.layout_method)
+        for i in np.flatnonzero(placed).tolist():
+            item = self._get_text_item(word_ids[i], int(font_sizes[i]))
+            # the layout measures the boxes of text documents, the simple item draws without their margin
+            item.setPos(positions[i, 0] + TEXT_MARGIN, positions[i, 1] + TEXT_MARGIN)
             self.scene.addItem(item)
@@ -0,0 +1,145 @@
+import math
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PySide6.QtGui import QFont, QFontMetricsF
+
+TEXT_MARGIN = 4  # document margin of QGraphicsTextItem around its text
+SPIRAL_GRID_CELL = 4  # cell size (in pixels) of the collision grid of the spiral layout
+SPIRAL_STEPS = 50000  # maximal number of the positions tried for one word
+SPIRAL_WORDS = 200  # maximal number of the words tried by the spiral layout
+
+
+class WordCloudLayout():
+    """
+    Places the words of a wordcloud without creating any graphics items.
+    The words are measured with font metrics cached per (integer) font size, the positions are computed
+    as arrays and only the words which fit into the scene get an item.
+    """
+    def __init__(self, width: float, height: float, family: str = "Arial") -> None:
+        self.width = width
+        self.height = height
+        self.family = family
+        self.fonts: Dict[int, QFont] = {}
+        self.metrics: Dict[int, QFontMetricsF] = {}
+
+    def font(self, size: int) -> QFont:
+        font = self.fonts.get(size)
+        if font is None:
+            font = QFont(self.family, size)
+            self.fonts[size] = font
+            self.metrics[size] = QFontMetricsF(font)
+        return font
+
+    def layout(self, word_ids: np.ndarray, font_sizes: np.ndarray, vocabulary,
+               method: str = "rows") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Positions of the words (sorted from the largest) and the mask of the words which fit into the scene.
+        Only the words which can still be placed are looked up in the vocabulary and measured.
+        """
+        n_words = word_ids.shape[0]
+        positions = np.zeros((n_words, 2))
+        if method == "spiral":
+            n_tried = min(n_words, SPIRAL_WORDS)
+            words = [vocabulary[idx] for idx in word_ids[:n_tried].tolist()]
+            placed = np.zeros(n_words, dtype=bool)
+            positions[:n_tried], placed[:n_tried] = self.spiral(*self.measure(words, font_sizes[:n_tried]))
+            return positions, placed
+
+        # the rows end with the first word which does not fit, measure in growing blocks until it is found
+        widths, heights = np.empty(0), np.empty(0)
+        block = 32
+        while True:
+            start, end = widths.shape[0], widths.shape[0] + block
+            words = [vocabulary[idx] for idx in word_ids[start:end].tolist()]
+            block_widths, block_heights = self.measure(words, font_sizes[start:end])
+            widths = np.concatenate([widths, block_widths])
+            heights = np.concatenate([heights, block_heights])
+            row_positions = self.rows(widths, heights)
+            if row_positions.shape[0] < widths.shape[0] or widths.shape[0] == n_words:
+                break
+            block *= 2
+        positions[:row_positions.shape[0]] = row_positions
+        return positions, np.arange(n_words) < row_positions.shape[0]
+
+    def measure(self, words: List[str], font_sizes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Widths and heights of the text items of the words (the text followed by a space)
+        """
+        widths = np.empty(len(words))
+        heights = np.empty(len(words))
+        for i, (word, size) in enumerate(zip(words, font_sizes.tolist())):
+            self.font(size)
+            metrics = self.metrics[size]
+            widths[i] = metrics.horizontalAdvance(word + " ") + 2 * TEXT_MARGIN
+            # the text document rounds the line height up to whole pixels
+            heights[i] = math.ceil(metrics.height()) + 2 * TEXT_MARGIN
+        return widths, heights
+
+    def rows(self, widths: np.ndarray, heights: np.ndarray) -> np.ndarray:
+        """
+        Fill the rows from the left, the words are bottom aligned to the first word of the row.
+        Returns the (n, 2) positions of the words which fit, the rest is cut off.
+        """
+        positions = np.empty((widths.shape[0], 2))
+        x, y = 0.0, 0.0
+        row_height = None
+        for i, (width, height) in enumerate(zip(widths.tolist(), heights.tolist())):
+            if width + x <= self.width:
+                if not row_height:  # to have it aligned from the bottom
+                    row_height = height
+                positions[i] = x, y + (row_height - height) * 0.9
+                x += width
+            elif row_height is not None and height + row_height + y <= self.height:
+                y += row_height
+                row_height = height
+                positions[i] = 0, y
+                x = width
+            else:
+                return positions[:i]
+        return positions
+
+    def spiral(self, widths: np.ndarray, heights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Place every word at the first free position of a spiral around the centre of the scene.
+        The free positions are looked up in a collision grid (its summed-area table answers whether a rectangle
+        is empty for all the spiral positions at once), at most SPIRAL_STEPS positions are tried per word.
+        Returns the (n, 2) positions and the mask of the placed words.
+        """
+        n_cols = int(math.ceil(self.width / SPIRAL_GRID_CELL))
+        n_rows = int(math.ceil(self.height / SPIRAL_GRID_CELL))
+        occupied = np.zeros((n_rows, n_cols), dtype=np.int32)
+        summed_area = np.zeros((n_rows + 1, n_cols + 1), dtype=np.int32)
+
+        # archimedean spiral (in grid cells) with about one cell between the consecutive positions and the turns,
+        # stretched to the aspect ratio of the scene and long enough to reach its corners
+        n_steps = min(SPIRAL_STEPS, int(np.pi * n_rows ** 2 / 2) + 1)
+        angle = np.sqrt(np.arange(n_steps) * 4 * np.pi)
+        radius = angle / (2 * np.pi)
+        spiral = np.column_stack([radius * np.cos(angle) * n_cols / n_rows, radius * np.sin(angle)])
+
+        positions = np.zeros((widths.shape[0], 2))
+        placed = np.zeros(widths.shape[0], dtype=bool)
+        failed = []  # sizes of the words which did not fit, no larger word can fit either
+        for i, (width, height) in enumerate(zip(widths.tolist(), heights.tolist())):
+            w = int(math.ceil(width / SPIRAL_GRID_CELL))
+            h = int(math.ceil(height / SPIRAL_GRID_CELL))
+            if w > n_cols or h > n_rows or any(w >= w_failed and h >= h_failed for w_failed, h_failed in failed):
+                continue
+            # top left cells of the word centred on the spiral positions, inside the scene
+            cols = np.round(spiral[:, 0] + (n_cols - w) / 2).astype(np.int64)
+            rows = np.round(spiral[:, 1] + (n_rows - h) / 2).astype(np.int64)
+            inside = (cols >= 0) & (rows >= 0) & (cols + w <= n_cols) & (rows + h <= n_rows)
+            cols, rows = cols[inside], rows[inside]
+            taken = (summed_area[rows + h, cols + w] - summed_area[rows, cols + w]
+                     - summed_area[rows + h, cols] + summed_area[rows, cols])
+            free = np.flatnonzero(taken == 0)
+            if not free.shape[0]:
+                failed.append((w, h))
+                continue
+            col, row = cols[free[0]], rows[free[0]]
+            occupied[row:row + h, col:col + w] = 1
+            summed_area[1:, 1:] = occupied.cumsum(axis=0).cumsum(axis=1)
+            positions[i] = col * SPIRAL_GRID_CELL, row * SPIRAL_GRID_CELL
+            placed[i] = True
+        return positions, placed
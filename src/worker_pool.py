@@ -0,0 +1,153 @@
+"""
+Pool of long-lived worker processes whose running jobs can be stopped.
+concurrent.futures.ProcessPoolExecutor can only cancel the jobs which have not started yet, here the worker of a
+cancelled running job is terminated through its own Process handle and a new worker is started for the next jobs.
+Qt is not imported, the workers only import the modules of the job functions.
+"""
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import CancelledError, Future
+from typing import List, Optional
+
+TERMINATE_TIMEOUT = 5  # seconds to wait for a terminated worker to exit
+
+
+def _worker_loop(connection) -> None:
+    # body of a worker process: receives (function, args, kwargs), sends back (succeeded, result or exception)
+    while True:
+        try:
+            function, args, kwargs = connection.recv()
+        except EOFError:
+            return
+        try:
+            reply = (True, function(*args, **kwargs))
+        except Exception as e:
+            reply = (False, e)
+        try:
+            connection.send(reply)
+        except Exception as e:  # the result or the exception could not be pickled
+            connection.send((False, RuntimeError(f"{type(e).__name__}: {e}")))
+
+
+class _Worker():
+    """
+    One worker process and the thread receiving its replies
+    """
+    def __init__(self, context, on_reply) -> None:
+        self.connection, child_connection = context.Pipe()
+        # daemonic, the workers never keep the application from exiting
+        self.process = context.Process(target=_worker_loop, args=(child_connection,), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.future: Optional[Future] = None
+        self.reader = threading.Thread(target=self._read, args=(on_reply,), daemon=True)
+        self.reader.start()
+
+    def _read(self, on_reply) -> None:
+        while True:
+            try:
+                succeeded, value = self.connection.recv()
+            except (EOFError, OSError):
+                self.connection.close()
+                on_reply(self, None, RuntimeError("The worker process exited unexpectedly"))
+                return
+            on_reply(self, succeeded, value)
+
+    def terminate(self) -> None:
+        self.process.terminate()
+        self.process.join(TERMINATE_TIMEOUT)
+
+
+class WorkerPool():
+    """
+    Runs submitted jobs in up to n_workers spawned processes, the workers are started on demand and reused
+    """
+    def __init__(self, n_workers: int) -> None:
+        self.n_workers = n_workers
+        self.context = multiprocessing.get_context("spawn")  # forking a process with a running Qt application is not safe
+        self.workers: List[_Worker] = []
+        self.queue = deque()  # (future, function, args, kwargs) of the jobs waiting for a worker
+        # reentrant, completing a future in the GUI thread may submit the next job right away
+        self.lock = threading.RLock()
+        self.closed = False
+
+    def submit(self, function, *args, **kwargs) -> Future:
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("The worker pool is shut down")
+            self.queue.append((future, function, args, kwargs))
+            self._dispatch()
+        return future
+
+    def cancel(self, future: Future) -> None:
+        """
+        Drop a waiting job, or stop a running one by terminating its worker (it completes with CancelledError)
+        """
+        if future.cancel():
+            return
+        with self.lock:
+            worker = next((worker for worker in self.workers if worker.future is future), None)
+            if worker is None:
+                return  # already finished
+            self.workers.remove(worker)
+            worker.future = None
+            worker.terminate()
+            self._dispatch()
+        if not future.done():
+            future.set_exception(CancelledError())
+
+    def shutdown(self) -> None:
+        """
+        Cancel the waiting jobs and terminate all the workers (with their running jobs)
+        """
+        with self.lock:
+            self.closed = True
+            waiting = [job[0] for job in self.queue]
+            self.queue.clear()
+            workers, self.workers = self.workers, []
+            running = [worker.future for worker in workers if worker.future is not None]
+            for worker in workers:
+                worker.future = None
+                worker.terminate()
+        for future in waiting:
+            future.cancel()
+        for future in running:
+            if not future.done():
+                future.set_exception(CancelledError())
+
+    def _dispatch(self) -> None:
+        # called with the lock held, starts the waiting jobs in the idle (or new) workers
+        while self.queue and not self.closed:
+            worker = next((worker for worker in self.workers if worker.future is None), None)
+            if worker is None:
+                if len(self.workers) >= self.n_workers:
+                    return
+                worker = _Worker(self.context, self._on_reply)
+                self.workers.append(worker)
+            future, function, args, kwargs = self.queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                worker.connection.send((function, args, kwargs))
+            except Exception as e:  # the worker died or the job could not be pickled
+                self.workers.remove(worker)
+                worker.terminate()
+                future.set_exception(e)
+                continue
+            worker.future = future
+
+    def _on_reply(self, worker: _Worker, succeeded: Optional[bool], value) -> None:
+        # called in the reader thread of the worker, succeeded is None when the worker process exited
+        with self.lock:
+            future, worker.future = worker.future, None
+            if succeeded is None and worker in self.workers:
+                self.workers.remove(worker)
+            self._dispatch()
+        if future is None or future.done():
+            return
+        if succeeded:
+            future.set_result(value)
+        else:
+            future.set_exception(value)